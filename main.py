@@ -1,9 +1,15 @@
+import concurrent.futures
+import functools
+import itertools
 import os
+import re
 
 from utils.case_insensitive_twin_files import handle_for_case_insensitive_twins
+from utils.case_insensitive_twin_files import add_twin_candidate, case_insensitive_key
 from utils.files import copy_directory, get_paths_for_renaming
 from utils.files import do_actual_renaming, find_long_paths, create_logs_dir
-from utils.languages import transliterate_russian_and_german, remove_bad_chars
+from utils.files import group_names_by_parent_dir, rename_in_names_by_parent_dir, write_lines
+from utils.languages import fast_normalize
 from utils.name_shortening import shorten_name
 from utils.prints_and_envs import parse_terminal_args, raise_error_if_collision
 from utils.prints_and_envs import actual_or_dry_run_print, print_proposed_changes
@@ -27,6 +33,15 @@ TODO for future versions:
 """
 
 
+# most names are already clean: plain ASCII, no trailing dot, no whitespace artifacts like "_-".
+# Such names are returned by fast_normalize unchanged, so they skip it
+CLEAN_NAME_REGEX = re.compile(r"(?!.*(?:_-|-_))[A-Za-z0-9._+-]*[A-Za-z0-9_+-]")
+
+
+# the same names (e.g. "__init__.py", "index.html") recur many times in a tree,
+# and the sanitizers are deterministic (even the "unnamed_" fallback, see remove_bad_chars),
+# so a name is only sanitized once per run
+@functools.lru_cache(maxsize=65536)
 def sanitize_name(name, max_length=255, just_preserve_left7=False):
     """
     The proper order of renaming:
@@ -66,21 +81,21 @@ def sanitize_name(name, max_length=255, just_preserve_left7=False):
     '.tilde_lock.canned_responses.csv_'
     >>> sanitize_name("", 50).startswith("unnamed_")
     True
+    >>> sanitize_name("setup.py", 50), sanitize_name("name.", 50), sanitize_name("a_-b", 50)
+    ('setup.py', 'name', 'a_b')
     """
+    if len(name) <= max_length and CLEAN_NAME_REGEX.fullmatch(name):
+        return name
 
-    name = remove_bad_chars(name)
-
-    """Note: the translit must be done AFTER removing bad chars,
-    because the func also handles unicode normalization.
-    Othwerwise, it will fail to handle some umlauts etc. 
-    """
-    name = transliterate_russian_and_german(name)
+    # removes bad chars and transliterates (in this order, see the func for details)
+    name = fast_normalize(name)
 
     name = shorten_name(name, max_length, just_preserve_left7)
 
     return name
 
 
+@functools.lru_cache(maxsize=65536)
 def sanitize_ext(ext, max_ext_len=4):
     """To handle cases like "Thumbs.db:encryptable"
 
@@ -104,8 +119,12 @@ def sanitize_ext(ext, max_ext_len=4):
     return res
 
 
-def write_proposed_changes_to_file(proposed_changes, logs_dir, kind):
+def write_proposed_changes_to_file(proposed_changes, logs_dir, kind, sort_log7=False):
     """
+    The log follows the order of proposed_changes, i.e. the traversal order of the paths.
+    If sort_log7, it's sorted alphabetically by the old path instead (costly for millions of paths).
+    If nothing is proposed, no log is written, and None is returned instead of the log path.
+
     >>> import os
     >>> from utils.files import delete_dir
     >>> mock_proposed_changes = {"/1/path_a.txt": "/1/new_path_a.txt", "/2/path_b.txt": "/2/new_path_b.txt"}
@@ -124,64 +143,190 @@ def write_proposed_changes_to_file(proposed_changes, logs_dir, kind):
     /2/new_path_b.txt
     <BLANKLINE>
     <BLANKLINE>
+    >>> unsorted_changes = {"/2/path_b.txt": "/2/new_path_b.txt", "/1/path_a.txt": "/1/new_path_a.txt"}
+    >>> log_path = write_proposed_changes_to_file(unsorted_changes, mock_logs_dir, kind="files")
+    >>> with open(log_path, "r") as f:
+    ...     f.readline()
+    'path_b.txt\\n'
+    >>> log_path = write_proposed_changes_to_file(unsorted_changes, mock_logs_dir, kind="files", sort_log7=True)
+    >>> with open(log_path, "r") as f:
+    ...     f.readline()
+    'path_a.txt\\n'
+    >>> print(write_proposed_changes_to_file({}, mock_logs_dir, kind="dirs"))
+    None
+    >>> os.path.exists(os.path.join(mock_logs_dir, "proposed_dirs_changes.txt"))
+    False
     >>> delete_dir(mock_logs_dir)
     (True, 'successfully deleted mock_logs_dir')
     """
+    if not proposed_changes:
+        return None
+
     logs_path = os.path.join(logs_dir, f"proposed_{kind}_changes.txt")
-    content = ""
-    for old_path in sorted(proposed_changes.keys()):
-        new_path = proposed_changes[old_path]
-        content += os.path.basename(old_path) + "\n"
-        content += os.path.basename(new_path) + "\n"
-        content += new_path + "\n"
-        content += "\n"
+    if sort_log7:
+        changes = sorted(proposed_changes.items())
+    else:
+        changes = proposed_changes.items()
 
-    with open(logs_path, "w") as f:
-        f.write(content)
+    # streamed block by block through a large buffer, instead of building the whole log in memory
+    with open(logs_path, "w", buffering=1 << 20) as f:
+        f.writelines(
+            f"{os.path.basename(old_path)}\n{os.path.basename(new_path)}\n{new_path}\n\n"
+            for old_path, new_path in changes
+        )
 
     return logs_path
 
 
-def cond_proposed_change(old_path, new_path, proposed_changes):
+@functools.lru_cache(maxsize=65536)
+def build_new_name(name, ext, sanitize_len):
     """
-    >>> cond_proposed_change("path.txt", "path.txt", {})
-    {}
-    >>> cond_proposed_change("path.txt", "new_path.txt", {})
-    {'path.txt': 'new_path.txt'}
-    >>> with open("new_path.txt", "w") as f:
-    ...     f.write("test")
-    4
-    >>> try:
-    ...     cond_proposed_change("path.txt", "new_path.txt", {})
-    ... except Exception as e:
-    ...     print(e)
-    Got a name collision: Proposed a new name: new_path.txt for the file: path.txt. But a file with the new name already exists at the same path. Exiting to prevent potential data loss.
-    >>> os.remove("new_path.txt")
+    Doesn't depend on the parent dir, so the same name is built only once for the whole tree.
+
+    >>> build_new_name(name="Thumbs", ext=".db:encryptable", sanitize_len=50)
+    'Thumbs.db_e'
     """
-    if old_path != new_path:
-        if os.path.exists(new_path):
-            raise_error_if_collision(old_path, new_path)
-        proposed_changes[old_path] = new_path
-    return proposed_changes
+    sanitized_name = sanitize_name(name, sanitize_len)
+    sanitized_ext = sanitize_ext(ext)
+    return sanitized_name + sanitized_ext
 
 
-def build_new_path(name, ext, parent_dir, sanitize_len):
+def join_new_name(parent_dir, new_name):
     """
+    The parent dir comes from splitting a path, so a plain concat does what os.path.join does.
 
-    >>> build_new_path(name="Thumbs", ext=".db:encryptable", parent_dir="some_dir", sanitize_len=50)
-    'some_dir/Thumbs.db_e'
+    >>> join_new_name("/", "a"), join_new_name("", "a"), join_new_name("b", "a")
+    ('/a', 'a', 'b/a')
+    """
+    if not parent_dir:
+        return new_name
+    if parent_dir.endswith(os.sep):  # the root
+        return f"{parent_dir}{new_name}"
+    return f"{parent_dir}{os.sep}{new_name}"
 
+
+def make_name_sanitizer(kind, max_full_name_len):
     """
-    sanitized_name = sanitize_name(name, sanitize_len)
-    sanitized_ext = sanitize_ext(ext)
-    new_name = sanitized_name + sanitized_ext
-    new_path = os.path.join(parent_dir, new_name)
-    return new_path
+    Returns a function that builds the new name for an old name of the given kind.
+    The kind and the max length are the same for the whole run,
+    so they are baked into the function once, instead of being checked for each of the names.
+
+    >>> sanitize_file_name = make_name_sanitizer("files", 20)
+    >>> sanitize_file_name("b c.txt"), sanitize_file_name(".bash rc")
+    ('b_c.txt', '.bash_rc')
+    >>> make_name_sanitizer("dirs", 20)("b c.txt")
+    'b_c.txt'
+    """
+    build = build_new_name  # a local lookup is faster than a global one
+
+    if kind == "files":
+        def sanitize(old_name):
+            stem, dot, ext = old_name.rpartition(".")
+            if stem.strip("."):  # like os.path.splitext, leading dots are not an extension
+                ext = dot + ext
+                return build(stem, ext, max_full_name_len - len(ext))
+            return build(old_name, "", max_full_name_len)
+    else:  # kind == 'dirs'
+        def sanitize(old_name):
+            return build(old_name, "", max_full_name_len)
+
+    return sanitize
+
 
+# the proposals are pure CPU work and independent per path, so big trees are split into
+# chunks of this many paths and sanitized in worker processes
+PROPOSALS_CHUNK_SIZE = 1000
 
-def propose_sanitisations(paths, kind, max_full_name_len, replace_symlinks7=False):
+
+def iter_proposals(paths, kind, max_full_name_len, symlink_paths):
+    """
+    Yields the (old_path, new_path) pairs, with the sanitized new path for each of the paths.
+    Doesn't touch the file system.
+
+    >>> list(iter_proposals(["/a/b c.txt", "/a/link"], "files", 20, {"/a/link"}))
+    [('/a/b c.txt', '/a/b_c.txt'), ('/a/link', '/a/link.slk')]
+
+    >>> # like os.path.splitext, leading dots are not an extension
+    >>> list(iter_proposals(["/.bash rc", "/a/..b c"], "files", 20, set()))
+    [('/.bash rc', '/.bash_rc'), ('/a/..b c', '/a/..b_c')]
+    """
+    sanitize = make_name_sanitizer(kind, max_full_name_len)
+    symlink_ext = ".slk"
+    for old_path in paths:
+        # a single parse per path instead of dirname and basename
+        parent_dir, sep, old_name = old_path.rpartition(os.sep)
+        if sep and not parent_dir:  # a path in the root, e.g. "/name"
+            parent_dir = sep
+
+        if old_path in symlink_paths:
+            new_name = build_new_name(
+                old_name, symlink_ext, max_full_name_len - len(symlink_ext)
+            )
+        else:
+            new_name = sanitize(old_name)
+
+        yield old_path, join_new_name(parent_dir, new_name)
+
+
+def propose_chunk(paths, kind, max_full_name_len, symlink_paths):
+    """
+    Runs in a worker process. Returns a list, as generators can't be sent between processes.
+
+    >>> propose_chunk(["/a/b c.txt"], "files", 20, set())
+    [('/a/b c.txt', '/a/b_c.txt')]
+    """
+    return list(iter_proposals(paths, kind, max_full_name_len, symlink_paths))
+
+
+def iter_proposals_in_parallel(
+        paths, kind, max_full_name_len, symlink_paths, max_workers, chunk_size
+):
+    """
+    Same as iter_proposals, but the chunks of paths are sanitized in worker processes.
+    The pairs are yielded chunk by chunk, in the order of the paths.
+    Executor.map submits all the chunks at once, so this is not lazy: the finished chunks wait in their futures
+    until they are yielded. If the caller stops early (e.g. on a collision), the chunks not started yet are cancelled.
+
+    >>> paths = ["a b", "c d", "e f"]
+    >>> list(iter_proposals_in_parallel(paths, "dirs", 20, set(), max_workers=2, chunk_size=2))
+    [('a b', 'a_b'), ('c d', 'c_d'), ('e f', 'e_f')]
+    >>> list(iter_proposals_in_parallel(paths, "files", 20, {"e f"}, max_workers=2, chunk_size=2))
+    [('a b', 'a_b'), ('c d', 'c_d'), ('e f', 'e_f.slk')]
+    """
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    # each worker gets only the symlinks of its own chunk, not the whole set pickled again per chunk
+    chunks_symlinks = [symlink_paths.intersection(chunk) for chunk in chunks]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for pairs in executor.map(
+                    propose_chunk,
+                    chunks,
+                    itertools.repeat(kind),
+                    itertools.repeat(max_full_name_len),
+                    chunks_symlinks,
+            ):
+                yield from pairs
+        finally:
+            # otherwise, leaving the with block would wait for all the submitted chunks
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def propose_sanitisations(
+        paths,
+        kind,
+        max_full_name_len,
+        replace_symlinks7=False,
+        existing_by_dir=None,
+        max_workers=None,
+        chunk_size=PROPOSALS_CHUNK_SIZE,
+        twins_families=None,
+        symlink_paths=None,
+):
     """
     Proposes sanitized names for files or directories, handling symlinks if specified.
+    The symlinks are taken from symlink_paths (e.g. collected by get_paths_for_renaming),
+    or, if it's not provided, each path is checked with os.path.islink.
+    If twins_families (a dict) is provided, the case-insensitive twins are collected into it on the way.
 
     >>> import os
     >>> from unittest.mock import patch
@@ -198,6 +343,9 @@ def propose_sanitisations(paths, kind, max_full_name_len, replace_symlinks7=Fals
     some-very-long-filename.txt -> smVryLngFilename.txt
     symlink -> symlink.slk
     directory with spaces -> directoryWithSpaces
+    >>> proposed = propose_sanitisations(paths, "files", 20, replace_symlinks7=True, symlink_paths={"/path/to/symlink"})
+    >>> os.path.basename(proposed["/path/to/symlink"])
+    'symlink.slk'
 
     >>> # Test for directories
     >>> paths = [
@@ -209,33 +357,112 @@ def propose_sanitisations(paths, kind, max_full_name_len, replace_symlinks7=Fals
     ...     print(f"{os.path.basename(old)} -> {os.path.basename(new)}")
     very long directory name -> vryLngDrctryNme
     another dir -> another_dir
-    """
-    proposed_changes = dict()
-    for old_path in paths:
-        parent_dir = os.path.dirname(old_path)
-        old_name = os.path.basename(old_path)
 
-        if replace_symlinks7 and os.path.islink(old_path):
-            name = old_name
-            ext = ".slk"
-            sanitize_len = max_full_name_len - len(ext)
-        else:
-            if kind == "files":
-                name, ext = os.path.splitext(old_name)
-                sanitize_len = max_full_name_len - len(ext)
-            else:  # item_type == 'dirs'
-                name = old_name
-                ext = ""
-                sanitize_len = max_full_name_len
+    >>> # Test that the parallel proposals are the same as the serial ones
+    >>> paths = [f"/path/to/file number {i}.txt" for i in range(10)]
+    >>> parallel = propose_sanitisations(paths, "files", 15, chunk_size=3)
+    >>> serial = propose_sanitisations(paths, "files", 15, max_workers=1)
+    >>> list(parallel.items()) == list(serial.items())
+    True
 
-        new_path = build_new_path(name, ext, parent_dir, sanitize_len)
-        proposed_changes = cond_proposed_change(old_path, new_path, proposed_changes)
+    >>> # Test the collision checks
+    >>> propose_sanitisations(["path.txt"], "files", 20)
+    {}
+    >>> propose_sanitisations(["new path.txt"], "files", 20)
+    {'new path.txt': 'new_path.txt'}
+    >>> with open("new_path.txt", "w") as f:
+    ...     f.write("test")
+    4
+    >>> try:
+    ...     propose_sanitisations(["new path.txt"], "files", 20)
+    ... except Exception as e:
+    ...     print(e)
+    Got a name collision: Proposed a new name: new_path.txt for the file: new path.txt. But a file with the new name already exists at the same path. Exiting to prevent potential data loss.
+    >>> os.remove("new_path.txt")
+
+    >>> # existing_by_dir is keyed by case_insensitive_key
+    >>> existing_by_dir = {"some_dir": {"new path.txt", "new_path.txt", "newer path.txt", "other_path.txt"}}
+    >>> propose_sanitisations(["some_dir/newer path.txt"], "files", 20, existing_by_dir=existing_by_dir)
+    {'some_dir/newer path.txt': 'some_dir/newer_path.txt'}
+    >>> try:
+    ...     propose_sanitisations(["some_dir/new path.txt"], "files", 20, existing_by_dir=existing_by_dir)
+    ... except FileExistsError as e:
+    ...     print(str(e).startswith("Got a name collision:"))
+    True
+    >>> try:  # the same name in another case is the same file on macOS and Windows
+    ...     propose_sanitisations(["some_dir/Other path.txt"], "files", 20, existing_by_dir=existing_by_dir)
+    ... except FileExistsError as e:
+    ...     print(str(e).startswith("Got a name collision:"))
+    True
+    >>> # but a name may take another case of itself ("ß" becomes "ss")
+    >>> propose_sanitisations(["d/ß.txt"], "files", 20, existing_by_dir={"d": {case_insensitive_key("ß.txt")}})
+    {'d/ß.txt': 'd/ss.txt'}
+
+    >>> # Test collecting the twins
+    >>> twins_families = dict()
+    >>> proposed = propose_sanitisations(["a/b.txt", "a/B.txt", "a/c d.txt"], "files", 20, twins_families=twins_families)
+    >>> list(twins_families)
+    ['a/b.txt']
+    >>> [twin["filesystem_path"] for twin in twins_families["a/b.txt"]]
+    ['a/b.txt', 'a/B.txt']
+    """
+    # checked in the parent, as the workers only get the paths
+    if not replace_symlinks7:
+        symlink_paths = set()
+    elif symlink_paths is None:
+        symlink_paths = {path for path in paths if os.path.islink(path)}
+
+    # the pairs are consumed as they come, without a full list of them. In parallel,
+    # the chunks' results are held until consumed (see iter_proposals_in_parallel)
+    if max_workers == 1 or len(paths) <= chunk_size:
+        pairs = iter_proposals(paths, kind, max_full_name_len, symlink_paths)
+    else:
+        pairs = iter_proposals_in_parallel(
+            paths, kind, max_full_name_len, symlink_paths, max_workers, chunk_size
+        )
+
+    # the collision checks are done here, in order, inlined as it's the hot loop.
+    # If existing_by_dir (the case_insensitive_key of the existing items, grouped by parent dir) is provided,
+    # the check is done in memory. Otherwise, the file system is asked.
+    proposed_changes = dict()
+    first_by_key = dict()
+    for old_path, new_path in pairs:
+        if twins_families is not None:
+            add_twin_candidate(old_path, new_path, first_by_key, twins_families)
+        if old_path != new_path:
+            if existing_by_dir is None:
+                collision7 = os.path.exists(new_path)
+            else:
+                # by the keys, as on macOS and Windows a name in another case is taken too,
+                # except for the item's own old name
+                new_key = case_insensitive_key(new_path)
+                siblings = existing_by_dir.get(os.path.dirname(new_key), ())
+                collision7 = (
+                    os.path.basename(new_key) in siblings
+                    and new_key != case_insensitive_key(old_path)
+                )
+            if collision7:
+                raise_error_if_collision(old_path, new_path)
+            proposed_changes[old_path] = new_path
 
     return proposed_changes
 
 
-def build_proposed_changes(paths, kind, max_full_name_len, replace_symlinks7=False):
+def build_proposed_changes(
+        paths,
+        kind,
+        max_full_name_len,
+        replace_symlinks7=False,
+        symlink_paths=None,
+        existing_by_dir=None,
+):
     """
+    existing_by_dir (see group_names_by_parent_dir) must hold the names of all the entries of the scanned dirs:
+    the files, the dirs and the junk files, as a new name must not collide with any of them.
+    It's grouped by the case_insensitive_key of the paths, as the names that differ only in case
+    are the same name on macOS and Windows.
+    If it's not provided, the file system is asked instead.
+
     >>> paths = []
     >>> paths.append("some files/some_very_lengthy_title_1-s2.0-S1116733756302733-main.pdf")
     >>> paths.append("Screenshot 2024-07-09 at 11.58.17.png")
@@ -263,11 +490,29 @@ def build_proposed_changes(paths, kind, max_full_name_len, replace_symlinks7=Fal
     pdfs_with_lengthy_names
     pdfs with lengthy names/very long names of pdfs definietly worth renaming them for soure
     pdfs with lengthy names/vryLngNmsfPdfsDfntlyWrthRn_rSr
+
+    >>> # a file can't take the name of a dir
+    >>> existing_by_dir = group_names_by_parent_dir(map(case_insensitive_key, ["a/a b", "a/A_B"]))
+    >>> try:
+    ...     build_proposed_changes(["a/a b"], "files", 30, existing_by_dir=existing_by_dir)
+    ... except FileExistsError as e:
+    ...     print(str(e).startswith("Got a name collision:"))
+    True
     """
+    # the twins are found while proposing, so the paths are not scanned again for them
+    twins_families = dict()
     proposed_changes = propose_sanitisations(
-        paths, kind, max_full_name_len, replace_symlinks7
+        paths,
+        kind,
+        max_full_name_len,
+        replace_symlinks7,
+        existing_by_dir,
+        twins_families=twins_families,
+        symlink_paths=symlink_paths,
+    )
+    proposed_changes, _ = handle_for_case_insensitive_twins(
+        paths, proposed_changes, twins_families=twins_families
     )
-    proposed_changes, _ = handle_for_case_insensitive_twins(paths, proposed_changes)
 
     return proposed_changes
 
@@ -280,6 +525,8 @@ def rename_items(
         actually_rename7=False,
         verbose7=False,
         replace_symlinks7=False,
+        symlink_paths=None,
+        existing_by_dir=None,
 ):
     """
     Renames files or directories based on the given parameters.
@@ -289,6 +536,8 @@ def rename_items(
     :param max_full_name_len: Maximum length for the full name
     :param kind: 'files' or 'dirs'
     :param actually_rename: Boolean to determine if renaming should actually occur
+    :param symlink_paths: Set of the symlinks among the paths, if already known
+    :param existing_by_dir: Names of all the scanned entries by parent dir, for the collision checks (see build_proposed_changes)
     :return: Dictionary of proposed changes
 
     >>> paths = []
@@ -324,19 +573,28 @@ def rename_items(
     actual_or_dry_run_print(actually_rename7)
 
     proposed_changes = build_proposed_changes(
-        paths, kind, max_full_name_len, replace_symlinks7=replace_symlinks7
+        paths,
+        kind,
+        max_full_name_len,
+        replace_symlinks7=replace_symlinks7,
+        symlink_paths=symlink_paths,
+        existing_by_dir=existing_by_dir,
     )
-    print_proposed_changes(proposed_changes, verbose7)
+    if verbose7:
+        print_proposed_changes(proposed_changes)
 
     log_path = write_proposed_changes_to_file(proposed_changes, logs_dir, kind=kind)
     success7, failed_renames, rename_report = do_actual_renaming(
-        proposed_changes, actually_rename7, replace_symlinks7=replace_symlinks7
+        proposed_changes,
+        actually_rename7,
+        replace_symlinks7=replace_symlinks7,
+        symlink_paths=symlink_paths,
     )
 
     return success7, proposed_changes, log_path, rename_report, failed_renames
 
 
-def handle_long_paths(directory_path, max_path_len, logs_dir):
+def handle_long_paths(directory_path, max_path_len, logs_dir, all_paths=None):
     """
 
     >>> import os
@@ -345,44 +603,62 @@ def handle_long_paths(directory_path, max_path_len, logs_dir):
     >>> files_path = "mock_data/some_files"
     >>> temp_log_dir = "temp_log_dir"
     >>> _ = create_nested_dirs(temp_log_dir)
-    >>> long_paths_remain7, long_paths, log_path = handle_long_paths(files_path, max_path_len=30, logs_dir=temp_log_dir)
+    >>> long_paths_remain7, long_paths_count, log_path = handle_long_paths(files_path, max_path_len=30, logs_dir=temp_log_dir)
     Searching for long paths...
     <BLANKLINE>
-    WARNING! Ther are still 9 full paths that longer than the specified max_path_len of 30 characters.
+    WARNING! Ther are still 7 full paths that longer than the specified max_path_len of 30 characters.
     >>> with open(log_path, "r") as f:
     ...     lines = f.readlines()
     >>> len(lines)
-    9
+    7
     >>> lines[0].strip()
     'mock_data/some_files/0001-feat-all-support-multi-message-chats-refactor-improv.patch'
+    >>> lines == sorted(lines)  # the same order as with the already scanned paths, see below
+    True
     >>> _, _ = delete_dir(temp_log_dir)
 
     >>> _ = create_nested_dirs(temp_log_dir)
-    >>> long_paths_remain7, long_paths, log_path = handle_long_paths(files_path, max_path_len=256, logs_dir=temp_log_dir)
+    >>> long_paths_remain7, long_paths_count, log_path = handle_long_paths(files_path, max_path_len=256, logs_dir=temp_log_dir)
     Searching for long paths...
     <BLANKLINE>
     Good news! All paths are within the limits
     >>> _, _ = delete_dir(temp_log_dir)
+
+    >>> # the already scanned paths can be provided to avoid walking the tree again
+    >>> _ = create_nested_dirs(temp_log_dir)
+    >>> all_paths = ["some_dir/a_rather_long_name.txt", "some_dir/short.txt", "some_dir/long_dir_name"]
+    >>> long_paths_remain7, long_paths_count, log_path = handle_long_paths(files_path, max_path_len=20, logs_dir=temp_log_dir, all_paths=all_paths)
+    Searching for long paths...
+    <BLANKLINE>
+    WARNING! Ther are still 2 full paths that longer than the specified max_path_len of 20 characters.
+    >>> with open(log_path, "r") as f:
+    ...     f.read().splitlines()
+    ['some_dir/a_rather_long_name.txt', 'some_dir/long_dir_name']
+    >>> _, _ = delete_dir(temp_log_dir)
     """
 
     print("Searching for long paths...")
-    long_paths = find_long_paths(directory_path, max_path_len)
-    if len(long_paths) > 0:
+    # either way, the log is sorted alphabetically. Only the long paths are kept in memory for that,
+    # not all the paths of the tree
+    if all_paths is None:
+        long_paths = find_long_paths(directory_path, max_path_len)
+    else:
+        long_paths = sorted(path for path in all_paths if len(path) > max_path_len)
+
+    log_path = os.path.join(logs_dir, "long_paths.txt")
+    # the paths are written to the file in big blocks, and only counted
+    long_paths_count = write_lines(log_path, long_paths)
+
+    if long_paths_count > 0:
         print(
-            f"\nWARNING! Ther are still {len(long_paths)} full paths that longer than the specified max_path_len of {max_path_len} characters."
+            f"\nWARNING! Ther are still {long_paths_count} full paths that longer than the specified max_path_len of {max_path_len} characters."
         )
         long_paths_remain7 = True
     else:
         print("\nGood news! All paths are within the limits")
         long_paths_remain7 = False
 
-    log_path = os.path.join(logs_dir, "long_paths.txt")
-    # save the list to a file
-    with open(log_path, "w") as f:
-        for path in long_paths:
-            f.write(path + "\n")
-
-    return long_paths_remain7, long_paths, log_path
+    return long_paths_remain7, long_paths_count, log_path
 
 
 def make_renaming_preparations(
@@ -515,6 +791,60 @@ def rename_dir_with_files(
     False
     >>> _ = delete_dir(target_dir)
 
+    >>> # the new names are checked against all the scanned entries, in any case:
+    >>> # a file against a dir, or against a junk file
+    >>> import tempfile
+    >>> collisions = [("a_b", True, "a b"), ("A_B", True, "a b"), ("Thumbs.db", False, "Thumbs .db"), ("Thumbs.db", False, "thumbs .db")]
+    >>> for existing_name, existing_dir7, new_name in collisions:
+    ...     with tempfile.TemporaryDirectory() as temp_dir:
+    ...         if existing_dir7:
+    ...             os.mkdir(os.path.join(temp_dir, existing_name))
+    ...         else:
+    ...             open(os.path.join(temp_dir, existing_name), "w").close()
+    ...         open(os.path.join(temp_dir, new_name), "w").close()
+    ...         try:
+    ...             _ = rename_dir_with_files(temp_dir, max_full_name_len=50, max_path_len=256, in_place7=True)
+    ...         except FileExistsError as e:
+    ...             print(str(e).startswith("Got a name collision:"))
+    The max_full_name_len you selected is passing the sanity check
+    Renaming files...
+    This is a dry run of renaming...
+    True
+    The max_full_name_len you selected is passing the sanity check
+    Renaming files...
+    This is a dry run of renaming...
+    True
+    The max_full_name_len you selected is passing the sanity check
+    Renaming files...
+    This is a dry run of renaming...
+    True
+    The max_full_name_len you selected is passing the sanity check
+    Renaming files...
+    This is a dry run of renaming...
+    True
+
+    >>> # in a dry run in place, the long paths are found among the scanned paths, without walking the tree again,
+    >>> # and the log is the same as the walk gives. A run in a copy, or an actual one, walks the tree
+    >>> import contextlib, io
+    >>> from unittest.mock import patch
+    >>> from utils.files import find_long_paths
+    >>> with tempfile.TemporaryDirectory() as temp_dir:
+    ...     os.mkdir(os.path.join(temp_dir, "dir_a"))
+    ...     open(os.path.join(temp_dir, "dir_a", "a_rather_long_file_name.txt"), "w").close()
+    ...     max_path_len = len(temp_dir) + 20
+    ...     walked_long_paths = find_long_paths(temp_dir, max_path_len)
+    ...     copy_dir = temp_dir + "_copy"
+    ...     runs = [dict(in_place7=True), dict(where_to_copy=copy_dir), dict(in_place7=True, actually_rename7=True)]
+    ...     for run_args in runs:
+    ...         with patch("main.find_long_paths", wraps=find_long_paths) as walk, contextlib.redirect_stdout(io.StringIO()):
+    ...             _, report = rename_dir_with_files(temp_dir, max_full_name_len=50, max_path_len=max_path_len, **run_args)
+    ...         with open(report["long_paths_log_path"]) as f:
+    ...             logged_long_paths = f.read().splitlines()
+    ...         print(walk.called, len(logged_long_paths), logged_long_paths == walked_long_paths)
+    ...     _ = delete_dir(copy_dir)
+    False 1 True
+    True 1 True
+    True 1 True
     """
 
     args_to_check = {
@@ -537,6 +867,15 @@ def rename_dir_with_files(
     report["copy_success7"] = copy_success7
 
     if copy_success7 and not mock_copy_fail7:
+        # the tree is already scanned, so the collisions are checked in memory, without a stat per new path.
+        # A new name must not collide with any entry: a file with a dir, or with a skipped junk file,
+        # in any case (see build_proposed_changes)
+        existing_by_dir = group_names_by_parent_dir(
+            map(
+                case_insensitive_key,
+                itertools.chain(paths_by_kind["files"], paths_by_kind["dirs"], paths_by_kind["junk"]),
+            )
+        )
         kinds = ["files", "dirs"]
         successes_by_kind = dict()
         for kind in kinds:
@@ -555,7 +894,20 @@ def rename_dir_with_files(
                 actually_rename7=actually_rename7,
                 replace_symlinks7=replace_symlinks7,
                 verbose7=False,
+                symlink_paths=paths_by_kind["symlinks"],
+                existing_by_dir=existing_by_dir,
             )
+            if actually_rename7:
+                # the dirs are checked against the files as they are after the renaming
+                failed_old_paths = {old_path for old_path, _, _ in failed_renames}
+                rename_in_names_by_parent_dir(
+                    existing_by_dir,
+                    (
+                        (case_insensitive_key(old_path), case_insensitive_key(new_path))
+                        for old_path, new_path in proposed_changes.items()
+                        if old_path not in failed_old_paths
+                    ),
+                )
             successes_by_kind[kind] = rename_success7
             report[f"{kind} renaming successful?"] = rename_success7
             report[f"{kind} renaming report"] = items_rename_report
@@ -570,8 +922,14 @@ def rename_dir_with_files(
 
         print("\nRenaming process completed. ")
 
+        # in a dry run in the scanned dir, nothing was changed since the scan,
+        # so the scanned paths are reused instead of walking the tree again
+        all_paths = None
+        if not actually_rename7 and (in_place7 or not where_to_copy):
+            all_paths = itertools.chain(paths_by_kind["files"], paths_by_kind["dirs"])
+
         long_paths_remain7, _, long_log_path = handle_long_paths(
-            directory_path, max_path_len, logs_dir
+            directory_path, max_path_len, logs_dir, all_paths
         )
         report["long_paths_remain7"] = long_paths_remain7
         report["long_paths_log_path"] = long_log_path
@@ -1,4 +1,6 @@
-import glob
+import bisect
+import concurrent.futures
+import importlib
 import unittest
 import doctest
 import coverage
@@ -8,6 +10,29 @@ import sys
 import os
 from unittest.mock import patch, MagicMock
 
+# the badge color for the coverage of at least this many percent
+COVERAGE_COLORS = (
+    (95, "#4c1"),  # green
+    (90, "#9c0"),
+    (75, "#aa1"),
+    (60, "#db2"),
+    (40, "#f70"),
+    (0, "#e54"),  # red
+)
+# the same, ascending, for bisect
+COVERAGE_THRESHOLDS, COVERAGE_THRESHOLD_COLORS = zip(*reversed(COVERAGE_COLORS))
+
+COVERAGE_BADGE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+    <svg xmlns="http://www.w3.org/2000/svg" width="104" height="20">
+    <rect width="63" height="20" fill="#555"/>
+    <rect x="63" width="41" height="20" fill="{color}"/>
+    <g fill="#fff" text-anchor="middle" font-family="DejaVu Sans,Verdana,Geneva,sans-serif" font-size="11">
+        <text x="31.5" y="14">coverage</text>
+        <text x="83.5" y="14">{total}%</text>
+    </g>
+    </svg>
+"""
+
 
 def genereate_coverage_badge(cov, name_suffix=""):
     """
@@ -46,45 +71,26 @@ def genereate_coverage_badge(cov, name_suffix=""):
         This function writes the SVG to a file named 'coverage{suffix}.svg' in the current directory.
         The doctests will create and delete this file during testing.
     """
-    coverage_template = """<?xml version="1.0" encoding="UTF-8"?>
-    <svg xmlns="http://www.w3.org/2000/svg" width="104" height="20">
-    <rect width="63" height="20" fill="#555"/>
-    <rect x="63" width="41" height="20" fill="{{ color }}"/>
-    <g fill="#fff" text-anchor="middle" font-family="DejaVu Sans,Verdana,Geneva,sans-serif" font-size="11">
-        <text x="31.5" y="14">coverage</text>
-        <text x="83.5" y="14">{{ total }}%</text>
-    </g>
-    </svg>
-"""
-    total_str = str(int(round(cov.report(show_missing=True, skip_covered=True))))
-    color = next(
-        c
-        for r, c in [
-            (95, "#4c1"),  # green
-            (90, "#9c0"),
-            (75, "#aa1"),
-            (60, "#db2"),
-            (40, "#f70"),
-            (0, "#e54"),  # red
-        ]
-        if int(total_str) >= r
-    )
-    badge = coverage_template.replace("{{ total }}", total_str).replace(
-        "{{ color }}", color
-    )
+    total = int(round(cov.report(show_missing=True, skip_covered=True)))
+    total_str = str(total)
+    # the color of the highest threshold that is not above the total
+    color = COVERAGE_THRESHOLD_COLORS[bisect.bisect_right(COVERAGE_THRESHOLDS, total) - 1]
+    badge = COVERAGE_BADGE_TEMPLATE.format(total=total_str, color=color)
     filename = f"coverage{name_suffix}.svg"
     with open(filename, "w") as f:
         f.write(badge)
-    return open(filename).readlines()
+    # the same lines as reading the file back would give
+    return badge.splitlines(keepends=True)
 
 
-def recursive_file_search(path, file_type):
+def recursive_file_search(path, file_type, exclusions=None):
     """
     Recursively search for files of a specific type in the given path.
 
     Args:
         path (str): The directory path to start the search from.
         file_type (str): The file extension to search for (e.g., '.py', '.txt').
+        exclusions (list, optional): The dirs whose paths contain any of these strings are not descended into.
 
     Returns:
         list: A sorted list of file paths matching the given file type.
@@ -124,13 +130,73 @@ def recursive_file_search(path, file_type):
         ...     result = recursive_file_search(tmpdir, '.nonexistent')
         ...     len(result)
         0
+
+        >>> # Test with an excluded dir
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     os.makedirs(os.path.join(tmpdir, 'venv', 'lib'))
+        ...     open(os.path.join(tmpdir, 'venv', 'lib', 'file1.txt'), 'w').close()
+        ...     open(os.path.join(tmpdir, 'file2.txt'), 'w').close()
+        ...     result = recursive_file_search(tmpdir, '.txt', exclusions=['venv/'])
+        ...     [os.path.basename(path) for path in result]
+        ['file2.txt']
     """
     # print("path", path)
-    files = glob.glob(os.path.join(path, "**", "*" + file_type), recursive=True)
-    sorted_files = sorted(files)
+    sorted_files = sorted(iter_files(path, file_type, exclusions))
     return sorted_files
 
 
+def compile_exclusions(exclusions):
+    """
+    Compiles the exclusions into a single regex, to check a path against all of them in one search.
+    Returns None if there are no exclusions.
+
+    Examples:
+        >>> bool(compile_exclusions(["venv/", "pkg2"]).search("pkg2/module.py"))
+        True
+        >>> print(compile_exclusions([]))
+        None
+    """
+    if not exclusions:
+        return None
+    return re.compile("|".join(map(re.escape, exclusions)))
+
+
+def iter_files(path, file_type, exclusions=None):
+    """
+    Yields the files of the type in the walk order, see recursive_file_search for the sorted list.
+    A direct os.scandir walk, as the entries already know if they are dirs or files.
+    Like glob("**/*" + file_type), it skips the hidden (dot) files and dirs.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     open(os.path.join(tmpdir, 'file1.txt'), 'w').close()
+        ...     open(os.path.join(tmpdir, '.hidden.txt'), 'w').close()
+        ...     files = iter_files(tmpdir, '.txt')
+        ...     [os.path.basename(path) for path in files]
+        ['file1.txt']
+    """
+    exclusions_regex = compile_exclusions(exclusions)
+    dirs_to_visit = [path]
+    while dirs_to_visit:
+        dir_path = dirs_to_visit.pop()
+        try:
+            with os.scandir(dir_path or ".") as scanned:  # closed right away, as this is a generator
+                entries = list(scanned)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            entry_path = os.path.join(dir_path, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                # if the dir path (with the trailing "/") contains an exclusion, so do all the paths in it
+                if not (exclusions_regex and exclusions_regex.search(entry_path + "/")):
+                    dirs_to_visit.append(entry_path)
+            elif entry.name.endswith(file_type) and entry.is_file():
+                yield entry_path
+
+
 def find_modules(exclusions=None):
     """
     Find Python modules in the current directory and its subdirectories, excluding specified paths.
@@ -195,22 +261,37 @@ def find_modules(exclusions=None):
         ...     result
         []
     """
-    file_names = recursive_file_search("", ".py")
-    if exclusions is None:
-        exclusions = []
-    module_names = []
-    for name in file_names:
-        if not any(exclusion in name for exclusion in exclusions):
-            clean_name = name.replace("/", ".").replace(".py", "")
-            module_names.append(clean_name)
+    module_names = sorted(iter_modules(exclusions))
     return module_names
 
 
+def iter_modules(exclusions=None):
+    """
+    Yields the module names in the walk order, see find_modules for the sorted list.
+
+    Examples:
+        >>> "tests_wrapper" in iter_modules(exclusions=["venv/"])
+        True
+    """
+    exclusions_regex = compile_exclusions(exclusions)
+    # the excluded dirs (e.g. venv/) are not even walked
+    for name in iter_files("", ".py", exclusions):
+        if not (exclusions_regex and exclusions_regex.search(name)):
+            # only the trailing ".py" is cut (replace would also hit e.g. "utils/my.pyx_helpers.py")
+            yield name[: -len(".py")].replace(os.sep, ".")
+
+
 def build_test_suite(module_names):
+    # the modules are imported in parallel, as it's mostly waiting for the disk.
+    # The suites are then built in the original order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        modules = list(executor.map(importlib.import_module, module_names))
+
     test_suite = unittest.TestSuite()
-    for name in module_names:
-        test_suite.addTests(doctest.DocTestSuite(name))
-        print("Added to the test_suite:", name)
+    for module in modules:
+        test_suite.addTests(doctest.DocTestSuite(module))
+    added = "".join(f"Added to the test_suite: {name}\n" for name in module_names)
+    sys.stdout.write(added)
     return test_suite
 
 
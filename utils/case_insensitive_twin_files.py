@@ -1,8 +1,57 @@
+import concurrent.futures
 import os
 from utils.files import get_file_creation_time
 import tempfile
 import time
 
+# the stats are mostly waiting for the disk (or the network, for NFS/SMB), so many threads help
+STAT_WORKERS = 32
+
+
+def case_insensitive_key(path):
+    """
+    Two paths are twins if they have the same key, i.e. are the same path on a case-insensitive file system.
+
+    >>> case_insensitive_key("/a/File.TXT") == case_insensitive_key("/a/file.txt")
+    True
+    >>> case_insensitive_key("/a/STRASSE.txt") == case_insensitive_key("/a/straße.txt")  # lower() misses this one
+    True
+    """
+    # casefold, not lower, as it also matches the letters that have no single lowercase pair, like ß.
+    # Better to add a prefix to a name in vain than to lose a file
+    return path.casefold()
+
+
+def add_twin_candidate(old_path, proposed_path, first_by_key, twins_families):
+    """
+    Registers the path, and adds a new family or a new twin to twins_families, if it's a twin.
+    Allows to find the twins on the fly, while the proposals are built, instead of in a separate pass.
+    first_by_key keeps just an (old_path, proposed_path) tuple per key.
+    The twin dicts are only built for the actual twins, which are rare.
+    Once a family is found, first_by_key keeps the family list itself, so the next twins are appended directly.
+
+    >>> first_by_key, twins_families = {}, {}
+    >>> add_twin_candidate('/a/h::.7z', '/a/h_.7z', first_by_key, twins_families)
+    >>> add_twin_candidate('/a/b.7z', '/a/b.7z', first_by_key, twins_families)
+    >>> add_twin_candidate('/a/h:.7z', '/a/h_.7z', first_by_key, twins_families)
+    >>> twins_families
+    {'/a/h::.7z': [{'filesystem_path': '/a/h::.7z', 'proposed_path': '/a/h_.7z'}, {'filesystem_path': '/a/h:.7z', 'proposed_path': '/a/h_.7z'}]}
+    """
+    key = case_insensitive_key(proposed_path)
+    first = first_by_key.get(key)
+    if first is None:
+        first_by_key[key] = (old_path, proposed_path)
+        return
+
+    if isinstance(first, tuple):  # the second twin, so a new family
+        existing_path, existing_proposed_path = first
+        family = [{'filesystem_path': existing_path, 'proposed_path': existing_proposed_path}]
+        twins_families[existing_path] = family
+        first_by_key[key] = family
+    else:
+        family = first
+    family.append({'filesystem_path': old_path, 'proposed_path': proposed_path})
+
 
 def identify_twins(paths, proposed_changes):
     """
@@ -13,36 +62,10 @@ def identify_twins(paths, proposed_changes):
     >>> twins_families
     {'/a/h::.7z': [{'filesystem_path': '/a/h::.7z', 'proposed_path': '/a/h_.7z'}, {'filesystem_path': '/a/h:.7z', 'proposed_path': '/a/h_.7z'}]}
     """
-    # Build combined_paths
-    combined_paths = []
-    for path in paths:
-        combined_paths.append({
-            'filesystem_path': path,
-            'proposed_path': proposed_changes.get(path, path)
-        })
-
     twins_families = {}
-    path_dict = {}
-
-    # Check for twins in combined_paths
-    for path_info in combined_paths:
-        lower_path = path_info['proposed_path'].lower()
-
-        if lower_path in path_dict:
-            # We found a twin
-            existing_path_info = path_dict[lower_path]
-            existing_path = existing_path_info['filesystem_path']
-            # Use the existing path's filesystem and proposed paths
-            if existing_path in twins_families:
-                twins_families[existing_path].append(path_info)
-            else:
-                twins_families[existing_path] = [
-                    existing_path_info,
-                    path_info
-                ]
-        else:
-            # Store the entire path_info, not just the filesystem_path
-            path_dict[lower_path] = path_info
+    first_by_key = {}
+    for path in paths:
+        add_twin_candidate(path, proposed_changes.get(path, path), first_by_key, twins_families)
 
     return twins_families
 
@@ -101,11 +124,24 @@ def apply_creation_times_to_twins(twins_families, creation_times_available7=True
     14
     Creation times are different and in the correct order
     """
+    if creation_times_available7:
+        # each path is stat-ed only once, and the stats are done concurrently, as they are mostly waiting for the disk
+        paths_to_stat = list({
+            twin['filesystem_path']
+            for twins in twins_families.values()
+            for twin in twins
+            if 'ctime' not in twin
+        })
+        ctimes = dict()
+        if paths_to_stat:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=STAT_WORKERS) as executor:
+                ctimes = dict(zip(paths_to_stat, executor.map(get_file_creation_time, paths_to_stat)))
+
     for twins in twins_families.values():
         if creation_times_available7:
             for twin in twins:
                 if 'ctime' not in twin:
-                    twin['ctime'] = get_file_creation_time(twin['filesystem_path'])
+                    twin['ctime'] = ctimes[twin['filesystem_path']]
         else:
             # Sort twins alphabetically by filesystem_path
             sorted_twins = sorted(twins, key=lambda x: x['filesystem_path'].lower())
@@ -186,27 +222,25 @@ def fix_twins(proposed_changes, twins_families, mock_updated_families=None, crea
             old_path = twin['filesystem_path']
             current_proposed_path = twin['proposed_path']
 
-            # Generate new name with prefix
-            dir_name = os.path.dirname(current_proposed_path)
-            file_name = os.path.basename(current_proposed_path)
-            new_name = f"tw{index}_{file_name}"
-            new_path = os.path.join(dir_name, new_name)
+            # Generate new name with prefix. A single split, and sep is "" for a path without a dir
+            dir_name, sep, file_name = current_proposed_path.rpartition(os.sep)
+            new_path = f"{dir_name}{sep}tw{index}_{file_name}"
 
-            # Update proposed_changes
-            if old_path in proposed_changes:
-                proposed_changes[old_path] = new_path
-            else:
-                proposed_changes[old_path] = new_path
+            # Update proposed_changes (adds the twins that weren't renamed before)
+            proposed_changes[old_path] = new_path
 
     return proposed_changes
 
 
-def handle_for_case_insensitive_twins(paths, proposed_changes, creation_times_available7=True):
+def handle_for_case_insensitive_twins(
+        paths, proposed_changes, creation_times_available7=True, twins_families=None
+):
     """
     Checks for case-insensitive duplicates among existing paths and proposed changes.
 
     :param paths: List of all file or directory paths
     :param proposed_changes: Dictionary of proposed changes {old_path: new_path}
+    :param twins_families: If the twins were already found (see add_twin_candidate), the paths are not scanned again
     :return: Tuple of (proposed_changes, dict of twins families)
 
     dict of twins families has the a structure like this:
@@ -273,9 +307,20 @@ def handle_for_case_insensitive_twins(paths, proposed_changes, creation_times_av
     >>> _, twins = handle_for_case_insensitive_twins(paths, proposed_changes, creation_times_available7=False)
     >>> sorted([item['filesystem_path'] for item in twins['/path/file1.txt']])
     ['/path/FILE1.txt', '/path/File1.txt', '/path/file1.txt']
+
+    # The already found twins
+    >>> paths = ['/a/h::.7z', '/a/h:.7z']
+    >>> proposed_changes = {'/a/h::.7z': '/a/h_.7z', '/a/h:.7z': '/a/h_.7z'}
+    >>> found_twins = identify_twins(paths, proposed_changes)
+    >>> proposed_changes, _ = handle_for_case_insensitive_twins([], proposed_changes, False, found_twins)
+    >>> proposed_changes
+    {'/a/h::.7z': '/a/tw1_h_.7z', '/a/h:.7z': '/a/tw0_h_.7z'}
     """
 
-    twins_families = identify_twins(paths, proposed_changes)
+    if twins_families is None:
+        twins_families = identify_twins(paths, proposed_changes)
+    if not twins_families:  # the common case, nothing to fix
+        return proposed_changes, twins_families
     proposed_changes = fix_twins(proposed_changes, twins_families, creation_times_available7=creation_times_available7)
 
     return proposed_changes, twins_families
\ No newline at end of file
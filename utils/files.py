@@ -1,11 +1,28 @@
+import concurrent.futures
 import datetime
+import functools
 import os
 import platform
 import shutil
 import pathlib
 import filecmp
+from collections import defaultdict
 
-JUNK_FILES = [".DS_Store", "Thumbs.db"]
+JUNK_FILES = frozenset([".DS_Store", "Thumbs.db"])
+# the same, for the walks on bytes paths
+JUNK_FILES_BYTES = frozenset(map(os.fsencode, JUNK_FILES))
+# the names dircmp skips: its defaults (like .git), and the junk files
+DIRCMP_IGNORES = filecmp.DEFAULT_IGNORES + sorted(JUNK_FILES)
+
+# the walks are mostly waiting for the file system, so more threads than cores help
+WALK_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# how many bytes of two files are read and compared at once. Bigger blocks than filecmp's 8 KB
+# mean fewer Python-level iterations
+FILES_COMPARE_BLOCK_SIZE = 1 << 20
+
+# how many chars of lines are collected before they are written with a single os.write
+LINES_BLOCK_SIZE = 1 << 20
 
 
 def create_nested_dirs(raw_nested_path, mock_crash7=False, mock_partial_success7=False):
@@ -31,8 +48,9 @@ def create_nested_dirs(raw_nested_path, mock_crash7=False, mock_partial_success7
     success7 = False
     try:
         1 / 0 if mock_crash7 else None
+        # raises if it fails, including when a file already has the path, so no need to check afterwards
         pathlib.Path(nested_path).mkdir(parents=True, exist_ok=True)
-        if pathlib.Path(nested_path).is_dir() and not mock_partial_success7:
+        if not mock_partial_success7:
             success7 = True
             # color_print(f"sucessfuly created dir {raw_nested_path}", "green")
 
@@ -71,13 +89,49 @@ def delete_dir(dir_path, mock_partial_success7=False):
     return success7, report
 
 
+def is_identical_file(path_a, path_b, block_size=FILES_COMPARE_BLOCK_SIZE):
+    """
+    Compares the contents of two files. The files of different sizes are not read at all.
+
+    >>> a = "mock_data/identical_and_different_dirs/A/someFile.txt"
+    >>> is_identical_file(a, "mock_data/identical_and_different_dirs/B/someFile.txt")
+    True
+    >>> is_identical_file(a, "mock_data/identical_and_different_dirs/C/someFile.txt")
+    False
+    >>> is_identical_file(a, "mock_data/identical_and_different_dirs/B/someFile.txt", block_size=1)
+    True
+    """
+    with open(path_a, "rb") as file_a, open(path_b, "rb") as file_b:
+        if os.fstat(file_a.fileno()).st_size != os.fstat(file_b.fileno()).st_size:
+            return False
+        while True:
+            block_a = file_a.read(block_size)
+            if block_a != file_b.read(block_size):
+                return False
+            if not block_a:
+                return True
+
+
 def is_identical_dir(
-    src, dst, mock_funny_file7=False, mock_error7=False, mock_mismatch7=False
+    src,
+    dst,
+    mock_funny_file7=False,
+    mock_error7=False,
+    mock_mismatch7=False,
+    deep7=False,
+    dirs_cmp=None,
+    fail_fast7=False,
 ):
     """
     A recursive function to verify that the dst directory is an exact copy of the src directory.
     Returns a tuple containing a boolean (True if identical, False otherwise) and a list of mismatches.
 
+    The files with the same type, size and modification time are considered identical, as for a copy
+    that's enough to catch a failed or partial copy. Their contents are compared only if deep7.
+    The subdirs are compared with the dircmp objects the parent dircmp already has (dirs_cmp),
+    so each dir is listed only once.
+    If fail_fast7, returns at the first mismatch found, without comparing the rest of the dirs.
+
     "Funny files" (technical term) in filecmp are files that exist in both directories being compared
     but couldn't be compared normally due to issues like permission problems, symbolic links, or special file types.
 
@@ -103,16 +157,23 @@ def is_identical_dir(
     False
     >>> is_identical_dir(a, b, mock_error7=True)[0]
     True
+    >>> is_identical_dir(a, c, deep7=True) == (identical7, diffs)
+    True
+    >>> is_identical_dir(a, c, fail_fast7=True)
+    (False, ['someFile.txt'])
+    >>> is_identical_dir(a, b, fail_fast7=True)
+    (True, [])
     """
 
-    if not os.path.isdir(src) or not os.path.isdir(dst):
-        return False, [f"Directory mismatch: {src} or {dst} is not a directory"]
+    if dirs_cmp is None:
+        if not os.path.isdir(src) or not os.path.isdir(dst):
+            return False, [f"Directory mismatch: {src} or {dst} is not a directory"]
+        dirs_cmp = filecmp.dircmp(src, dst, ignore=DIRCMP_IGNORES)
 
     if mock_mismatch7:
         return False, ["a fake mismatch, as if directories are not identical"]
 
     mismatches = []
-    dirs_cmp = filecmp.dircmp(src, dst)
 
     if len(dirs_cmp.left_only) > 0:
         mismatches.extend([f"Only in {src}: {item}" for item in dirs_cmp.left_only])
@@ -120,33 +181,50 @@ def is_identical_dir(
         mismatches.extend([f"Only in {dst}: {item}" for item in dirs_cmp.right_only])
     if len(dirs_cmp.funny_files) > 0 or mock_funny_file7:
         mismatches.extend([f"Funny file: {item}" for item in dirs_cmp.funny_files])
-
-    (_, mismatch, errors) = filecmp.cmpfiles(
-        src, dst, dirs_cmp.common_files, shallow=False
-    )
+    if fail_fast7 and mismatches:
+        return False, mismatches
+
+    if deep7:
+        mismatch, errors = [], []
+        for name in dirs_cmp.common_files:
+            try:
+                if not is_identical_file(os.path.join(src, name), os.path.join(dst, name)):
+                    mismatch.append(name)
+            except OSError:
+                errors.append(name)
+    else:
+        (_, mismatch, errors) = filecmp.cmpfiles(
+            src, dst, dirs_cmp.common_files, shallow=True
+        )
     if len(mismatch) > 0:
         mismatches.extend([f"{item}" for item in mismatch])
     if len(errors) > 0 or mock_error7:
         mismatches.extend([f"Error: {item}" for item in errors])
-
-    for common_dir in dirs_cmp.common_dirs:
-        new_src = os.path.join(src, common_dir)
-        new_dst = os.path.join(dst, common_dir)
-        identical, sub_mismatches = is_identical_dir(new_src, new_dst)
+    if fail_fast7 and mismatches:
+        return False, mismatches
+
+    for common_dir, sub_dirs_cmp in dirs_cmp.subdirs.items():
+        identical, sub_mismatches = is_identical_dir(
+            sub_dirs_cmp.left,
+            sub_dirs_cmp.right,
+            deep7=deep7,
+            dirs_cmp=sub_dirs_cmp,
+            fail_fast7=fail_fast7,
+        )
         if not identical:
             mismatches.extend(
                 [f"In subdirectory {common_dir}: {item}" for item in sub_mismatches]
             )
-
-    mismatches = [m for m in mismatches if os.path.basename(m) not in JUNK_FILES]
-    # print("test mismatches:", mismatches)
+            if fail_fast7:
+                break
 
     return len(mismatches) == 0, mismatches
 
 
-def copy_directory(src, dst, mock_mismatch7=False):
+def copy_directory(src, dst, verify7=True, mock_mismatch7=False):
     """
     Recursively copy the contents of a directory to another directory.
+    If verify7, the copy is then compared with the original. Without it, only the copy errors are reported.
 
     >>> src = "mock_data/identical_and_different_dirs/A"
     >>> dst = "mock_data/identical_and_different_dirs/copy of A"
@@ -161,26 +239,20 @@ def copy_directory(src, dst, mock_mismatch7=False):
     Something terribly wrong happened. The dirs aren't identical:
     a fake mismatch, as if directories are not identical
     False
+    >>> copy_directory(src, dst, verify7=False, mock_mismatch7=True)
+    True
     """
     success7 = False
     try:
-        # Create the destination directory if it doesn't exist
-        os.makedirs(dst, exist_ok=True)
-
-        # Walk through the source directory
-        for item in os.listdir(src):
-            s = os.path.join(src, item)
-            d = os.path.join(dst, item)
-            if os.path.isdir(s):
-                # Recursively copy subdirectories
-                copy_directory(s, d)
-            else:
-                # Copy files, including hidden ones
-                shutil.copy2(s, d)
+        # Copies the files (including hidden ones) with their metadata, like shutil.copy2
+        shutil.copytree(src, dst, dirs_exist_ok=True)
 
-        identical7, mismatches = is_identical_dir(
-            src, dst, mock_mismatch7=mock_mismatch7
-        )
+        if verify7:
+            identical7, mismatches = is_identical_dir(
+                src, dst, mock_mismatch7=mock_mismatch7
+            )
+        else:
+            identical7, mismatches = True, []
         if identical7:
             success7 = True
         else:
@@ -194,29 +266,161 @@ def copy_directory(src, dst, mock_mismatch7=False):
     return success7
 
 
+def scan_dir(root, junk_paths=None):
+    """
+    Lists the dir, classifying the entries like os.walk(followlinks=False) does: a symlink to a dir is a dir.
+    The junk files (like .DS_Store) are skipped, as they are neither renamed nor compared.
+    But they still take their names, so if a list is given as junk_paths, the skipped paths are collected into it.
+    The entries already know their types, so it costs no extra stat calls.
+    Returns a list of (path, is_dir7, symlink7) tuples. An unreadable dir gives an empty list, as os.walk skips it.
+    Like os.scandir, gives bytes paths for a bytes root.
+
+    >>> [entry for entry in scan_dir("mock_data/identical_and_different_dirs/A") if entry[1]]
+    [('mock_data/identical_and_different_dirs/A/someDir', True, False)]
+    >>> scan_dir("mock_data/no_such_dir")
+    []
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as temp_dir:
+    ...     open(os.path.join(temp_dir, "Thumbs.db"), "w").close()
+    ...     junk_paths = []
+    ...     scanned = scan_dir(temp_dir, junk_paths)
+    ...     junk_names = [os.path.basename(path) for path in junk_paths]
+    >>> scanned, junk_names
+    ([], ['Thumbs.db'])
+    """
+    try:
+        with os.scandir(root) as scanned:  # closed right away, not to hold the fd during the walk
+            entries = list(scanned)
+    except OSError:  # e.g. no permissions
+        return []
+
+    junk_files = JUNK_FILES if isinstance(root, str) else JUNK_FILES_BYTES
+    scanned_entries = []
+    for entry in entries:
+        if entry.name in junk_files:
+            if junk_paths is not None:
+                junk_paths.append(entry.path)  # list.append is atomic, so it's safe from the walk threads
+            continue
+        try:
+            is_dir7 = entry.is_dir()
+        except OSError:
+            is_dir7 = False
+        scanned_entries.append((entry.path, is_dir7, entry.is_symlink()))
+    return scanned_entries
+
+
+def iter_scanned_dirs(directory, junk_paths=None):
+    """
+    Walks the tree level by level. The dirs of a level are scanned in parallel threads,
+    as the walk is mostly waiting for the file system, not for the CPU.
+    Yields the scan_dir result of each dir. Within a level, the dirs come in the same order as in os.walk,
+    so the walk is deterministic.
+    If a list is given as junk_paths, the skipped junk files are collected into it (see scan_dir).
+
+    >>> scanned = list(iter_scanned_dirs("mock_data/identical_and_different_dirs/A"))
+    >>> len(scanned)  # A and A/someDir
+    2
+    """
+    scan = functools.partial(scan_dir, junk_paths=junk_paths)
+    level = [directory]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WALK_WORKERS) as executor:
+        while level:
+            next_level = []
+            for scanned_entries in executor.map(scan, level):
+                yield scanned_entries
+                next_level.extend(
+                    path
+                    for path, is_dir7, symlink7 in scanned_entries
+                    if is_dir7 and not symlink7  # the symlinks are not followed
+                )
+            level = next_level
+
+
 def get_paths_for_renaming(directory):
     """
+    Walks the tree like os.walk(directory, followlinks=False) does, but in parallel (see iter_scanned_dirs),
+    and collects the symlinks on the way.
+    The junk files are not renamed, but they are listed too, as the new names must not collide with them.
+
     >>> paths = get_paths_for_renaming("mock_data/identical_and_different_dirs/A")
     >>> paths["dirs"]
     ['mock_data/identical_and_different_dirs/A/someDir']
-    >>> files_paths = paths["files"]
-    >>> files_paths = [f for f in files_paths if os.path.basename(f) not in JUNK_FILES]
-    >>> files_paths
+    >>> paths["files"]
     ['mock_data/identical_and_different_dirs/A/someDir/another_file.txt', 'mock_data/identical_and_different_dirs/A/someFile.txt']
+    >>> paths["symlinks"]
+    set()
+    >>> paths["junk"]
+    []
     """
     # print("directory:", directory)
     dir_paths = []
     file_paths = []
-
-    for root, dirs, files in os.walk(directory, followlinks=False):
-        dir_paths.extend(os.path.join(root, d) for d in dirs)
-        file_paths.extend(os.path.join(root, f) for f in files)
+    symlink_paths = set()
+    junk_paths = []
+
+    for scanned_entries in iter_scanned_dirs(directory, junk_paths):
+        for path, is_dir7, symlink7 in scanned_entries:
+            if symlink7:
+                symlink_paths.add(path)
+            if is_dir7:
+                dir_paths.append(path)
+            else:
+                file_paths.append(path)
 
     # Sort both lists
-    dir_paths.sort(key=lambda x: (-x.count(os.path.sep), -len(x)))
-    file_paths.sort(key=lambda x: (-x.count(os.path.sep), -len(x)))
+    dir_paths = sort_deepest_first(dir_paths)
+    file_paths = sort_deepest_first(file_paths)
 
-    return {"dirs": dir_paths, "files": file_paths}
+    return {"dirs": dir_paths, "files": file_paths, "symlinks": symlink_paths, "junk": junk_paths}
+
+
+def sort_deepest_first(paths):
+    """
+    Sorts the paths by depth, then by length, both descending, so the items inside a dir are renamed before the dir.
+    The same-depth, same-length paths are sorted alphabetically.
+    Decorate-sort-undecorate, to compute the keys in a single comprehension instead of a call per path.
+
+    >>> sort_deepest_first(["a/b", "a/b/cc", "a/b/c", "a/bb", "a/ba"])
+    ['a/b/cc', 'a/b/c', 'a/ba', 'a/bb', 'a/b']
+    """
+    sep = os.path.sep
+    decorated = [(-path.count(sep), -len(path), path) for path in paths]
+    decorated.sort()
+    return [path for _, _, path in decorated]
+
+
+def group_names_by_parent_dir(paths):
+    """
+    Groups the names of the already-scanned paths by their parent dir,
+    so that name collisions can be checked in memory instead of with a stat call per path.
+
+    >>> names_by_dir = group_names_by_parent_dir(["a/x.txt", "a/y.txt", "b/x.txt", "z.txt"])
+    >>> sorted(names_by_dir["a"])
+    ['x.txt', 'y.txt']
+    >>> names_by_dir["b"]
+    {'x.txt'}
+    >>> names_by_dir[""]
+    {'z.txt'}
+    """
+    names_by_dir = defaultdict(set)
+    for path in paths:
+        names_by_dir[os.path.dirname(path)].add(os.path.basename(path))
+    return names_by_dir
+
+
+def rename_in_names_by_parent_dir(names_by_dir, renamed_pairs):
+    """
+    Updates the names grouped by group_names_by_parent_dir after the (old_path, new_path) renames,
+    so that the later collision checks see the names that are actually on the disk.
+
+    >>> names_by_dir = group_names_by_parent_dir(["a/x y.txt", "a/z.txt"])
+    >>> rename_in_names_by_parent_dir(names_by_dir, [("a/x y.txt", "a/x_y.txt")])
+    >>> sorted(names_by_dir["a"])
+    ['x_y.txt', 'z.txt']
+    """
+    for old_path, new_path in renamed_pairs:
+        names_by_dir[os.path.dirname(old_path)].discard(os.path.basename(old_path))
+        names_by_dir[os.path.dirname(new_path)].add(os.path.basename(new_path))
 
 
 def replace_symlink(old_path, new_path):
@@ -229,7 +433,7 @@ def replace_symlink(old_path, new_path):
     ...     with tempfile.TemporaryDirectory() as temp_dir:
     ...         target_path = os.path.join(temp_dir, 'target.txt')
     ...         with open(target_path, 'w') as f:
-    ...             f.write('Target content')
+    ...             _ = f.write('Target content')
     ...         link_path = os.path.join(temp_dir, 'link')
     ...         os.symlink(target_path, link_path)
     ...         new_path = os.path.join(temp_dir, 'new_file.txt')
@@ -265,19 +469,27 @@ def replace_symlink(old_path, new_path):
     """
     link_target = os.readlink(old_path)
     with open(new_path, "w") as f:
-        f.write(f"Original symlink: {old_path}\n")
-        f.write(f"Target: {link_target}\n")
-        f.write("The file was created by filenames_sanitiser.")
+        f.write(
+            f"Original symlink: {old_path}\n"
+            f"Target: {link_target}\n"
+            "The file was created by filenames_sanitiser."
+        )
 
-    # Remove the original symlink
-    if os.path.islink(old_path):  # Double-check it's still a symlink
-        os.unlink(old_path)
+    # Remove the original symlink. readlink has succeeded, so it's a symlink
+    os.unlink(old_path)
 
 
 def do_actual_renaming(
-    proposed_changes, actually_rename7, mock_error7=False, replace_symlinks7=False
+    proposed_changes,
+    actually_rename7,
+    mock_error7=False,
+    replace_symlinks7=False,
+    symlink_paths=None,
 ):
     """
+    symlink_paths is the set of the symlinks among the paths, as found by get_paths_for_renaming.
+    If it's not provided, each path is checked with os.path.islink.
+
     Do a test like this:
     copy a dir
     rename in the copy
@@ -311,6 +523,8 @@ def do_actual_renaming(
     >>> success7, failed_renames,_ = do_actual_renaming(proposed_changes, actually_rename7=True, mock_error7=True)
     >>> success7
     False
+    >>> failed_renames[0][2]
+    'a fake error, as if the renaming failed'
     >>> _ = delete_dir(target_dir)
 
     # Ensuring that renaming dirs will not trigger false positives in failures:
@@ -351,20 +565,25 @@ def do_actual_renaming(
     if actually_rename7:
         report["status"] = "commenced actual renaming"
         count = 0
-        for old_path, new_path in proposed_changes.items():
-
-            if replace_symlinks7 and os.path.islink(old_path):
-                replace_symlink(old_path, new_path)
-            else:
-                os.rename(old_path, new_path)
-
-            count += 1
-
-            if (not os.path.exists(new_path)) or mock_error7:
-                failed_renames.append((old_path, new_path))
+        for count, (old_path, new_path) in enumerate(proposed_changes.items(), start=1):
+            # a rename either succeeds or raises, so there is no need to check the new path afterwards
+            try:
+                if mock_error7:
+                    raise OSError("a fake error, as if the renaming failed")
+                if replace_symlinks7 and (
+                    old_path in symlink_paths
+                    if symlink_paths is not None
+                    else os.path.islink(old_path)
+                ):
+                    replace_symlink(old_path, new_path)
+                else:
+                    os.rename(old_path, new_path)
+            except OSError as e:
+                failed_renames.append((old_path, new_path, str(e)))
 
             # print progress every 10 tsd items
-            print(f"{count} of {total}") if count % 10000 == 0 else None
+            if count % 10000 == 0:
+                print(f"{count} of {total}")
 
         report["items count"] = f"attempted to rename {count} items"
 
@@ -377,26 +596,86 @@ def do_actual_renaming(
     return success7, failed_renames, report
 
 
+def iter_blocks_of_lines(lines, block_size=LINES_BLOCK_SIZE):
+    """
+    Groups the lines into lists of about block_size chars (including the newlines).
+
+    >>> list(iter_blocks_of_lines(["ab", "c", "defg", "h"], block_size=4))
+    [['ab', 'c'], ['defg'], ['h']]
+    """
+    block = []
+    block_len = 0
+    for line in lines:
+        block.append(line)
+        block_len += len(line) + 1
+        if block_len >= block_size:
+            yield block
+            block = []
+            block_len = 0
+    if block:
+        yield block
+
+
+def write_lines(file_path, lines, block_size=LINES_BLOCK_SIZE):
+    """
+    Writes the lines to the file in big blocks, with an os.write per block instead of a write per line.
+    The lines are consumed lazily, so a generator of millions of lines is fine.
+    Undecodable bytes in the names (see os.fsdecode) are written back as they were.
+    Returns the number of lines written.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as temp_dir:
+    ...     file_path = os.path.join(temp_dir, "lines.txt")
+    ...     count = write_lines(file_path, iter(["a", "b\\udcff", "c"]), block_size=2)
+    ...     with open(file_path, "rb") as f:
+    ...         content = f.read()
+    >>> count, content
+    (3, b'a\\nb\\xff\\nc\\n')
+    """
+    count = 0
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        for block in iter_blocks_of_lines(lines, block_size):
+            data = ("\n".join(block) + "\n").encode("utf-8", "surrogateescape")
+            view = memoryview(data)
+            while view:  # os.write may write only a part of the data
+                view = view[os.write(fd, view):]
+            count += len(block)
+    finally:
+        os.close(fd)
+    return count
+
+
+def iter_long_paths(directory, max_path_length):
+    """
+    Yields the long paths as the tree is walked (level by level, see iter_scanned_dirs),
+    so they don't have to be kept in memory.
+    The entries of each dir are yielded in the alphabetical order.
+    The tree is walked on bytes paths, and only the paths that are long in bytes are decoded:
+    a path has at most as many chars as bytes, so the others can't be long.
+
+    >>> long_paths = iter_long_paths("mock_data/some_files", 100)
+    >>> next(long_paths)
+    'mock_data/some_files/pdfs with lengthy names/very long names of pdfs definietly worth renaming them for soure'
+    """
+    for scanned_entries in iter_scanned_dirs(os.fsencode(directory)):
+        for path, _, _ in sorted(scanned_entries):
+            if len(path) > max_path_length:
+                path = os.fsdecode(path)
+                if len(path) > max_path_length:
+                    yield path
+
+
 def find_long_paths(directory, max_path_length):
     """
     >>> long_paths = find_long_paths("mock_data/some_files", 100)
-    >>> # exclude paths with junk files
-    >>> long_paths = [p for p in long_paths if os.path.basename(p) not in JUNK_FILES]
     >>> long_paths[0]
     'mock_data/some_files/pdfs with lengthy names/very long names of pdfs definietly worth renaming them for soure'
     >>> long_paths[1]
     'mock_data/some_files/pdfs with lengthy names/very long names of pdfs definietly worth renaming them for soure/some_very_lengthy_title_1-s2.0-S1116733756302733-main.pdf'
     """
-    long_paths = []
-
-    for root, dirs, files in os.walk(directory, followlinks=False):
-        for name in files + dirs:
-            path = os.path.join(root, name)
-            if len(path) > max_path_length:
-                long_paths.append(path)
-
     # sort alphabetically
-    long_paths.sort()
+    long_paths = sorted(iter_long_paths(directory, max_path_length))
 
     return long_paths
 
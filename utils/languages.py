@@ -1,21 +1,145 @@
 import re
 import unicodedata
-import random
+import zlib
 
 HTML_DIR_ENDINGS = ["_files", " Files", ".files", "-files", ".html_files"]
 HTML_DIR_ENDINGS.sort(key=len, reverse=True)  # sort by length, descending
-
-
-def transliterate_according_to_scheme(text, source_target_dict):
-    """ """
-
-    result = ""
-    for char in text:
-        if char.isupper():
-            result += source_target_dict.get(char.lower(), char).upper()
-        else:
-            result += source_target_dict.get(char, char)
-    return result
+# for a single str.endswith check of all the endings
+HTML_DIR_ENDINGS_TUPLE = tuple(HTML_DIR_ENDINGS)
+# the endings with their lengths, to find the matching one and how much to keep in a single loop
+HTML_DIR_ENDINGS_AND_LENGTHS = tuple((ending, len(ending)) for ending in HTML_DIR_ENDINGS)
+# any of the endings at the very end of a name. The alternatives are tried longest-first,
+# the same priority as the loop over the sorted list
+HTML_DIR_ENDINGS_REGEX = re.compile(
+    "(?:" + "|".join(map(re.escape, HTML_DIR_ENDINGS)) + r")\Z"
+)
+
+# the characters that are forbidden in names on Windows or on *nix, each replaced by "_".
+# The ASCII control chars are deleted in the same pass
+BAD_CHARS = '<>:"/\\|?*'
+BAD_CHARS_TABLE = str.maketrans(
+    {**dict.fromkeys(BAD_CHARS, "_"), **dict.fromkeys(map(chr, [*range(32), 0x7F]))}
+)
+
+# the same for ASCII names, as bytes. The ASCII control chars are deleted,
+# and NFKC doesn't change ASCII, so ASCII names skip the unicode steps
+ASCII_BAD_CHARS_TABLE = bytes.maketrans(BAD_CHARS.encode("ascii"), b"_" * len(BAD_CHARS))
+ASCII_CONTROL_CHARS = bytes(range(32)) + b"\x7f"
+ASCII_DIGITS = b"0123456789"
+
+# a run of non-digits that has a digit on both sides
+NON_DIGITS_BETWEEN_DIGITS_REGEX = re.compile(r"[0-9]([^0-9]+)(?=[0-9])")
+
+# the chars that are allowed in names, but can cause problems in scripts etc. Each is replaced by "_"
+QUESTIONABLE_CHARS = r"[](){}«»!@#%^=;,`’!—―‒"
+ASCII_QUESTIONABLE_CHARS = "".join(dict.fromkeys(char for char in QUESTIONABLE_CHARS if char.isascii()))
+ASCII_QUESTIONABLE_CHARS_TABLE = bytes.maketrans(
+    ASCII_QUESTIONABLE_CHARS.encode("ascii"), b"_" * len(ASCII_QUESTIONABLE_CHARS)
+)
+# the questionable chars that are replaced by something else
+QUESTIONABLE_CHARS_REPLACEMENTS = {
+    "&": "_and_",
+    "'": "",  # e.g. Asimov's -> Asimovs
+    "~": "tilde_",  # e.g. .~lock.canned_responses.csv
+}
+
+# a run of underscores, regardless of its length
+MULTIPLE_UNDERSCORES_REGEX = re.compile(r"_{2,}")
+
+GERMAN_LETTERS_AND_COMMON_LOAN_LETTERS = {
+    "ä": "ae",
+    "ö": "oe",
+    "ü": "ue",
+    "ß": "ss",
+    "é": "e",
+    "ç": "c",
+    "à": "a",
+    "è": "e",
+    "ì": "i",
+    "ò": "o",
+    "ù": "u",
+    "ñ": "n",
+    "ï": "i",
+}
+
+# see transliterate_russian for the properties of this scheme
+RUSSIAN_LETTERS = {
+    "а": "a",
+    "б": "b",
+    "в": "v",
+    "г": "g",
+    "д": "d",
+    "е": "je",
+    "ё": "jo",
+    "ж": "zh",
+    "з": "z",
+    "и": "i",
+    "й": "ji",
+    "к": "k",
+    "л": "l",
+    "м": "m",
+    "н": "n",
+    "о": "o",
+    "п": "p",
+    "р": "r",
+    "с": "s",
+    "т": "t",
+    "у": "u",
+    "ф": "f",
+    "х": "kh",
+    "ц": "c",
+    "ч": "ch",
+    "ш": "sh",
+    "щ": "xh",
+    "ъ": "qh",
+    "ы": "yh",
+    "ь": "jh",
+    "э": "e",
+    "ю": "uh",
+    "я": "ja",
+}
+
+
+# the uppercase letters whose lowercase form is in the schemes, but which upper() doesn't give, as "ß".upper() is "SS"
+UPPERCASE_LETTERS_MISSED_BY_UPPER = {"ẞ": "ß"}
+
+
+def make_transliteration_table(*schemes):
+    """
+    Builds a single str.translate table from one or more transliteration schemes.
+    The schemes map lowercase letters. An uppercase letter, i.e. the one whose lowercase form is in the schemes,
+    is mapped to the uppercased replacement of that form, e.g. "Ж" to "ZH", and "ẞ" to "SS".
+    The other chars are kept as they are.
+
+    >>> table = make_transliteration_table({"ж": "zh"}, {"ü": "ue"}, {"ß": "ss"})
+    >>> "Жür ẞ!".translate(table)
+    'ZHuer SS!'
+    >>> "Жук и Ёж".translate(RUSSIAN_TABLE)
+    'ZHuk i JOzh'
+    """
+    mapping = dict()
+    for scheme in schemes:
+        mapping.update(scheme)
+
+    # the uppercase letters are found from the letters of the schemes, instead of scanning all of unicode
+    uppercase_mapping = dict()
+    for source, target in mapping.items():
+        upper = source.upper()
+        if len(upper) == 1 and upper != source and upper.isupper() and upper.lower() == source:
+            uppercase_mapping[upper] = target.upper()
+    for upper, source in UPPERCASE_LETTERS_MISSED_BY_UPPER.items():
+        if source in mapping:
+            uppercase_mapping[upper] = mapping[source].upper()
+    mapping.update(uppercase_mapping)
+    return str.maketrans(mapping)
+
+
+# built once at import, to transliterate a name in a single pass
+GERMAN_TABLE = make_transliteration_table(GERMAN_LETTERS_AND_COMMON_LOAN_LETTERS)
+RUSSIAN_TABLE = make_transliteration_table(RUSSIAN_LETTERS)
+RUSSIAN_AND_GERMAN_TABLE = make_transliteration_table(
+    RUSSIAN_LETTERS, GERMAN_LETTERS_AND_COMMON_LOAN_LETTERS
+)
 
 
 def transliterate_german(text):
@@ -28,25 +152,7 @@ def transliterate_german(text):
     'Nyx’ Boe drueckt Vamps Quiz-Floss jaeh weg.'
     """
 
-    german_letters_and_common_loan_letters = {
-        "ä": "ae",
-        "ö": "oe",
-        "ü": "ue",
-        "ß": "ss",
-        "é": "e",
-        "ç": "c",
-        "à": "a",
-        "è": "e",
-        "ì": "i",
-        "ò": "o",
-        "ù": "u",
-        "ñ": "n",
-        "ï": "i",
-    }
-
-    result = transliterate_according_to_scheme(
-        text, german_letters_and_common_loan_letters
-    )
+    result = text.translate(GERMAN_TABLE)
     return result
 
 
@@ -74,55 +180,36 @@ def transliterate_russian(text):
     >>> transliterate_russian("non-russian text")
     'non-russian text'
     """
-    Russian_letters = {
-        "а": "a",
-        "б": "b",
-        "в": "v",
-        "г": "g",
-        "д": "d",
-        "е": "je",
-        "ё": "jo",
-        "ж": "zh",
-        "з": "z",
-        "и": "i",
-        "й": "ji",
-        "к": "k",
-        "л": "l",
-        "м": "m",
-        "н": "n",
-        "о": "o",
-        "п": "p",
-        "р": "r",
-        "с": "s",
-        "т": "t",
-        "у": "u",
-        "ф": "f",
-        "х": "kh",
-        "ц": "c",
-        "ч": "ch",
-        "ш": "sh",
-        "щ": "xh",
-        "ъ": "qh",
-        "ы": "yh",
-        "ь": "jh",
-        "э": "e",
-        "ю": "uh",
-        "я": "ja",
-    }
-
-    result = transliterate_according_to_scheme(text, Russian_letters)
+    result = text.translate(RUSSIAN_TABLE)
     return result
 
 
 def transliterate_russian_and_german(text):
     """
+    A single pass with the combined table. The Russian letters become Latin ones,
+    which the German scheme doesn't touch, so it's the same as transliterating Russian, then German.
 
     >>> transliterate_russian_and_german("Übung делает мастера")
     'UEbung djelajet mastjera'
     """
-    text = transliterate_russian(text)
-    text = transliterate_german(text)
-    return text
+    return text.translate(RUSSIAN_AND_GERMAN_TABLE)
+
+
+def fast_normalize(name):
+    """
+    Removes bad chars, and then transliterates the name in a single str.translate pass.
+
+    Note: the translit must be done AFTER removing bad chars,
+    because remove_bad_chars also handles unicode normalization.
+    Othwerwise, it will fail to handle some umlauts etc.
+
+    >>> fast_normalize("Übung: делает мастера")
+    'UEbung_djelajet_mastjera'
+    >>> fast_normalize("Эй, жлоб! Где:туз?")
+    'Eji_zhlob_Gdje_tuz_'
+    """
+    name = remove_bad_chars(name)
+    return name.translate(RUSSIAN_AND_GERMAN_TABLE)
 
 
 def to_camel_case(name, max_length, preserve_separators_between_digits7=False):
@@ -142,11 +229,10 @@ def to_camel_case(name, max_length, preserve_separators_between_digits7=False):
 
     # Check for HTML directory endings
     ending = ""
-    for html_ending in HTML_DIR_ENDINGS:
-        if name.endswith(html_ending):
-            ending = html_ending
-            name = name[: -len(html_ending)]
-            break
+    match = HTML_DIR_ENDINGS_REGEX.search(name)
+    if match:
+        ending = match.group()
+        name = name[: match.start()]
 
     result = []
     capitalize_next = False
@@ -196,19 +282,16 @@ def remove_questionable_chars(name):
     >>> remove_questionable_chars("Asimov, Isaac - Found! - 1978.txt")
     'Asimov_ Isaac - Found_ - 1978.txt'
     """
-    suspicious_chars = r"[](){}«»!@#%^=;,`’!—―‒"
-
-    special_replacements = {
-        "&": "_and_",
-        "'": "",  # e.g. Asimov's -> Asimovs
-        "~": "tilde_", # e.g. .~lock.canned_responses.csv
-    }
-
-    for char in suspicious_chars:
-        name = name.replace(char, "_")
+    if name.isascii():
+        # the chars are replaced with "_" in a single bytes pass
+        name = name.encode("ascii").translate(ASCII_QUESTIONABLE_CHARS_TABLE).decode("ascii")
+    else:
+        for char in QUESTIONABLE_CHARS:
+            name = name.replace(char, "_")
 
-    for char, replacement in special_replacements.items():
-        name = name.replace(char, replacement)
+    for char, replacement in QUESTIONABLE_CHARS_REPLACEMENTS.items():
+        if char in name:
+            name = name.replace(char, replacement)
 
     return name
 
@@ -242,6 +325,9 @@ def remove_bad_chars(name):
     >>> res = remove_bad_chars("") # empty string
     >>> res.startswith("unnamed_")
     True
+    >>> # the fallback is derived from the original name: the same for the same name, different for different ones
+    >>> remove_bad_chars("...") == remove_bad_chars("..."), remove_bad_chars("...") == remove_bad_chars(". .")
+    (True, False)
     >>> remove_bad_chars("9-10 - Brandon, Shea & Moore")
     '9-10_Brandon_Shea_and_Moore'
     >>> remove_bad_chars("__init__.cpython-38.pyc")
@@ -253,20 +339,24 @@ def remove_bad_chars(name):
     >>> remove_bad_chars("test__datasource.cpython-36.pyc")
     'test__datasource.cpython-36.pyc'
     """
+    original_name = name
     already_had_double_underscores7 = "__" in name
 
-    # Define bad characters
-    bad_chars = r'<>:"/\|?*'
-
-    # Replace bad characters with underscore
-    for char in bad_chars:
-        name = name.replace(char, "_")
+    if name.isascii():
+        # Replace bad characters with underscore and remove control characters, in a single pass
+        name = name.encode("ascii")
+        name = name.translate(ASCII_BAD_CHARS_TABLE, delete=ASCII_CONTROL_CHARS)
+        name = name.decode("ascii")
+    else:
+        # Replace bad characters with underscore and remove ASCII control characters, in a single pass
+        name = name.translate(BAD_CHARS_TABLE)
 
-    # Remove control characters
-    name = "".join(ch for ch in name if unicodedata.category(ch)[0] != "C")
+        # Remove the other control characters. A printable name has none, so it's skipped
+        if not name.isprintable():
+            name = "".join(ch for ch in name if unicodedata.category(ch)[0] != "C")
 
-    # Normalize unicode characters
-    name = unicodedata.normalize("NFKC", name)
+        # Normalize unicode characters
+        name = unicodedata.normalize("NFKC", name)
 
     # Remove trailing periods or spaces
     name = name.rstrip(". ")
@@ -277,17 +367,19 @@ def remove_bad_chars(name):
     name = name.replace(" ", "_")
 
     if not already_had_double_underscores7:  # to avoid damaging "__pycache__" etc
-        # remove duplicated underscores, regardless of their number
-        while "__" in name:
-            name = name.replace("__", "_")
+        # remove duplicated underscores, regardless of their number, in a single pass
+        name = MULTIPLE_UNDERSCORES_REGEX.sub("_", name)
 
     common_white_space_artifacts = ["_-_", "_-", "-_"]
     for artifact in common_white_space_artifacts:
         name = name.replace(artifact, "_")
 
-    # Ensure the name is not empty
+    # Ensure the name is not empty.
+    # The number is a checksum of the original name, so the siblings that are both emptied (like "..." and ". .")
+    # most likely get different names, and the same name always gets the same one, so the result can be cached
     if not name:
-        name += "unnamed_" + str(random.randint(10000, 99999))
+        checksum = zlib.crc32(original_name.encode("utf-8", "surrogatepass"))
+        name += "unnamed_" + str(10000 + checksum % 90000)
     return name
 
 
@@ -301,11 +393,17 @@ def proportion_of_digits_in_name(name):
     1.0
     >>> round(proportion_of_digits_in_name("Screenshot 2024-07-06 at 20.56.55"), 2)
     0.42
+    >>> proportion_of_digits_in_name("Фото 2024")
+    0.4444444444444444
     >>> proportion_of_digits_in_name("")
     0
     """
     if len(name) > 0:
-        digits = sum(1 for ch in name if ch.isdigit())
+        if name.isascii():
+            # the digits are the chars that the deletion removes
+            digits = len(name) - len(name.encode("ascii").translate(None, ASCII_DIGITS))
+        else:
+            digits = sum(map(str.isdigit, name))
         res = digits / len(name)
     else:
         res = 0
@@ -342,11 +440,16 @@ def find_non_digit_between_digits(text):
     ['_']
     >>> find_non_digit_between_digits("7abc7")
     ['abc']
+    >>> find_non_digit_between_digits("Фото 2024-07-06 ፩ и ②")
+    ['-', '-', ' ', ' и ']
     """
+    if text.isascii():
+        return NON_DIGITS_BETWEEN_DIGITS_REGEX.findall(text)
+
+    # \d is only the decimal digits, while str.isdigit also accepts e.g. the Ethiopic ones
     result = []
     current_substring = ""
     between_digits7 = False
-    # last_was_digit7 = False
 
     for char in text:
         if char.isdigit():
@@ -354,16 +457,7 @@ def find_non_digit_between_digits(text):
                 result.append(current_substring)
                 current_substring = ""
             between_digits7 = True
-            # last_was_digit7 = True
         elif between_digits7:
             current_substring += char
-            # last_was_digit7 = False
-        else:
-            # last_was_digit7 = False
-            pass
-
-    # Don't add the last substring if it's not followed by a digit
-    # if between_digits7 and current_substring and last_was_digit7:
-    #    result.append(current_substring)
 
     return result
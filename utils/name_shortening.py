@@ -1,10 +1,28 @@
+import functools
+import re
+
 from utils.languages import (
-    HTML_DIR_ENDINGS,
+    HTML_DIR_ENDINGS_AND_LENGTHS,
+    HTML_DIR_ENDINGS_TUPLE,
     find_non_digit_between_digits,
     proportion_of_digits_in_name,
     to_camel_case,
 )
 
+# for the ASCII names, the digit searches are done by str.lstrip / rstrip of all the other chars,
+# and the non-digits are removed with bytes.translate
+ASCII_NON_DIGITS = "".join(char for char in map(chr, range(128)) if not char.isdigit())
+ASCII_NON_DIGITS_BYTES = ASCII_NON_DIGITS.encode("ascii")
+# marks each non-digit with a zero byte, to split the name by them
+ASCII_NON_DIGITS_TO_ZERO_TABLE = bytes.maketrans(
+    ASCII_NON_DIGITS_BYTES, b"\0" * len(ASCII_NON_DIGITS_BYTES)
+)
+
+# no other char has one of them as its lowercase form, so these are all the chars that are vowels in any case
+ENGLISH_VOWELS = frozenset("aeiouAEIOU")
+ENGLISH_VOWELS_BYTES = b"aeiouAEIOU"
+ENGLISH_VOWELS_REGEX = re.compile("[aeiouAEIOU]")
+
 
 def shrink_the_middle(
     name,
@@ -44,27 +62,26 @@ def shrink_the_middle(
     else:
 
         """For properly handling dirs of saved html files: "_files", " Files", ".files", "-files" """
-        for ending in HTML_DIR_ENDINGS:
-            if name.endswith(ending):
-                keep_end = len(ending)
-                separator = ""  # because the ending already contains a separator
-                break
-
-        middle_max_length = max_length - keep_start - keep_end - len(separator)
-
-        if middle_max_length < 0:  # in such cases prioritize the end
-            # raise ValueError("keep_start and keep_end are too large for the max_length")
+        if name.endswith(HTML_DIR_ENDINGS_TUPLE):
+            for ending, ending_length in HTML_DIR_ENDINGS_AND_LENGTHS:
+                if name.endswith(ending):
+                    keep_end = ending_length
+                    separator = ""  # because the ending already contains a separator
+                    break
+
+        # the room for the start and the middle, after the end and the separator
+        available_length = max_length - keep_end - len(separator)
+        if keep_start > available_length:  # in such cases prioritize the end
             keep_start = 0
-            middle_max_length = max_length - keep_start - keep_end - len(separator)
+        middle_max_length = available_length - keep_start
 
-            if middle_max_length < 0:
-                if fallback_to_original7:
-                    return name
-                else:  # just keep as much as end as possible
-                    separator = ""
-                    keep_start = 0
-                    keep_end = max_length
-                    middle_max_length = 0
+        if middle_max_length < 0:  # even the end with the separator doesn't fit
+            if fallback_to_original7:
+                return name
+            # just keep as much as end as possible
+            separator = ""
+            keep_end = max_length
+            middle_max_length = 0
 
         start_str = name[:keep_start]
         end_str = name[-keep_end:]
@@ -77,6 +94,26 @@ def shrink_the_middle(
     return res
 
 
+def shrink_the_middle_default(name, max_length):
+    """
+    The same as shrink_the_middle with the default arguments, but without its generic branches
+    for the usual case: no HTML dir ending, and enough room for the kept start and end.
+
+    >>> shrink_the_middle_default("Screenshot on Mac 2024-07-06 at 20.56.55 dog", 20)
+    'Screenshot on Ma_dog'
+    >>> shrink_the_middle_default("Screenshot on Mac 2024-07-06 at 20.56.55 dog", 20) == shrink_the_middle("Screenshot on Mac 2024-07-06 at 20.56.55 dog", 20)
+    True
+    >>> shrink_the_middle_default("Asimov, Isaac - The Early Asimov - Volume 03 - 1972.html_files", 40)
+    'Asimov, Isaac - The Early Asi.html_files'
+    """
+    if len(name) <= max_length:
+        return name
+    # 7 is keep_start + keep_end + the separator
+    if max_length >= 7 and not name.endswith(HTML_DIR_ENDINGS_TUPLE):
+        return name[:3] + name[3:-3][: max_length - 7] + "_" + name[-3:]
+    return shrink_the_middle(name, max_length)
+
+
 def cond_remove_non_digits_between_digits(name, max_length):
     """
     The process, as illustrated by the this case: "Screenshot 2024-07-06 at 20.56.55 dog":
@@ -119,11 +156,12 @@ def shorten_non_digits_between_start_and_first_digit(name, max_length):
         return name
 
     # find the first digit
-    first_digit_ind = -1
-    for i, ch in enumerate(name):
-        if ch.isdigit():
-            first_digit_ind = i
-            break
+    if name.isascii():
+        first_digit_ind = len(name) - len(name.lstrip(ASCII_NON_DIGITS))
+        if first_digit_ind == len(name):
+            first_digit_ind = -1
+    else:
+        first_digit_ind = next((i for i, ch in enumerate(name) if ch.isdigit()), -1)
 
     if first_digit_ind >= 0:
         text_start = name[:first_digit_ind]
@@ -154,11 +192,12 @@ def shorten_non_digits_between_last_digit_and_end(name, max_length):
         return name
 
     # find the last digit
-    last_digit_ind = -1
-    for i, ch in enumerate(reversed(name)):
-        if ch.isdigit():
-            last_digit_ind = len(name) - i - 1
-            break
+    if name.isascii():
+        last_digit_ind = len(name.rstrip(ASCII_NON_DIGITS)) - 1
+    else:
+        last_digit_ind = next(
+            (i for i in range(len(name) - 1, -1, -1) if name[i].isdigit()), -1
+        )
 
     if last_digit_ind >= 0:
         chars_between_last_dig_and_end = len(name) - last_digit_ind - 1
@@ -181,6 +220,8 @@ def remove_non_digits(name, max_length):
     '20240706 20.56.55'
     >>> remove_non_digits("2024-07-06 20.56.55", 10)
     '20240706205655'
+    >>> remove_non_digits("Фото 2024-07-06", 12)
+    'о 2024-07-06'
     """
 
     if len(name) <= max_length:
@@ -188,19 +229,31 @@ def remove_non_digits(name, max_length):
 
     how_many_chars_to_remove = len(name) - max_length
 
+    if name.isascii():
+        name_bytes = name.encode("ascii")
+        digits = name_bytes.translate(None, ASCII_NON_DIGITS_BYTES)
+        if how_many_chars_to_remove >= len(name) - len(digits):
+            return digits.decode("ascii")  # all the non-digits are removed
+        # the non-digits are removed from the start: the split by the first ones leaves the rest intact
+        parts = name_bytes.translate(ASCII_NON_DIGITS_TO_ZERO_TABLE).split(
+            b"\0", how_many_chars_to_remove
+        )
+        rest = parts.pop()
+        return b"".join(parts).decode("ascii") + name[len(name) - len(rest) :]
+
     # it shouldn't be more than the number of non-digits in name
-    how_many_non_digits = sum(1 for ch in name if not ch.isdigit())
+    how_many_non_digits = len(name) - sum(map(str.isdigit, name))
     how_many_chars_to_remove = min(how_many_chars_to_remove, how_many_non_digits)
 
     # iteratively remove non-digits, starting from the start of name
-    clean_name = ""
+    clean_chars = []
     for ch in name:
         if ch.isdigit() or how_many_chars_to_remove == 0:
-            clean_name += ch
+            clean_chars.append(ch)
         else:
             how_many_chars_to_remove -= 1
 
-    return clean_name
+    return "".join(clean_chars)
 
 
 def shorten_name_containing_digits(name, max_length):
@@ -216,15 +269,23 @@ def shorten_name_containing_digits(name, max_length):
     '202407_655'
     >>> shorten_name_containing_digits("2 some long str after digit", 5)
     '2igit'
-
+    >>> shorten_name_containing_digits("2024-07-06", 10)
+    '2024-07-06'
     """
-    name = cond_remove_non_digits_between_digits(name, max_length)
-    name = shorten_non_digits_between_start_and_first_digit(name, max_length)
-    name = shorten_non_digits_between_last_digit_and_end(name, max_length)
-    name = remove_non_digits(name, max_length)
+    # from the gentlest to the harshest. Each step works on the result of the previous one,
+    # and the name is returned as soon as it's short enough
+    for shorten in (
+        cond_remove_non_digits_between_digits,
+        shorten_non_digits_between_start_and_first_digit,
+        shorten_non_digits_between_last_digit_and_end,
+        remove_non_digits,
+    ):
+        if len(name) <= max_length:
+            return name
+        name = shorten(name, max_length)
 
     # we tried to shorten it gently. If it's still too long, we just remove the middle
-    name = shrink_the_middle(name, max_length)
+    name = shrink_the_middle_default(name, max_length)
 
     return name
 
@@ -245,31 +306,37 @@ def skip_vowels(name, max_length):
     if len(name) <= max_length:
         return name
 
-    english_vowels = "aeiou"
-
     # Check for HTML directory endings
     ending = ""
-    for html_ending in HTML_DIR_ENDINGS:
-        if name.endswith(html_ending):
-            ending = html_ending
-            name = name[: -len(html_ending)]
-            break
+    if name.endswith(HTML_DIR_ENDINGS_TUPLE):
+        for html_ending, ending_length in HTML_DIR_ENDINGS_AND_LENGTHS:
+            if name.endswith(html_ending):
+                ending = html_ending
+                name = name[:-ending_length]
+                break
 
-    vowels_num = sum(1 for ch in name if ch.lower() in english_vowels)
+    if name.isascii():
+        vowels_num = len(name) - len(name.encode("ascii").translate(None, ENGLISH_VOWELS_BYTES))
+    else:
+        vowels_num = sum(1 for ch in name if ch in ENGLISH_VOWELS)
 
     how_many_chars_to_remove = len(name) - max_length
     how_many_chars_to_remove = min(how_many_chars_to_remove, vowels_num)
 
-    clean_name = ""
-    for ch in name:
-        if ch.lower() in english_vowels and how_many_chars_to_remove > 0:
-            how_many_chars_to_remove -= 1
-        else:
-            clean_name += ch
+    if how_many_chars_to_remove <= 0:
+        return name + ending
 
-    return clean_name + ending
+    # all the vowels go, so the bytes table does the whole job without any per-char checks
+    if how_many_chars_to_remove == vowels_num and name.isascii():
+        return name.encode("ascii").translate(None, ENGLISH_VOWELS_BYTES).decode("ascii") + ending
 
+    # only the first vowels go, and the regex stops right after the last of them
+    return ENGLISH_VOWELS_REGEX.sub("", name, count=how_many_chars_to_remove) + ending
 
+
+# different raw names often become the same after the normalization (e.g. "a b" and "a:b"),
+# and the shortening is pure, so each normalized name is only shortened once per run
+@functools.lru_cache(maxsize=65536)
 def shorten_name(name, max_length, just_preserve_left7=False):
     """
     >>> shorten_name("Screenshot on Mac 2024-07-06 at 20.56.55 dog", 50)
@@ -295,12 +362,18 @@ def shorten_name(name, max_length, just_preserve_left7=False):
     if just_preserve_left7:
         return name[:max_length]
 
+    # each step returns a short enough name as is, so no need to call the next ones
     name = to_camel_case(name, max_length, preserve_separators_between_digits7=True)
+    if len(name) <= max_length:
+        return name
 
     name = skip_vowels(name, max_length)
+    if len(name) <= max_length:
+        return name
 
     if proportion_of_digits_in_name(name) > 0.33:
         res = shorten_name_containing_digits(name, max_length)
     else:
-        res = shrink_the_middle(name, max_length)
+        res = shrink_the_middle_default(name, max_length)
     return res
+
@@ -36,11 +36,12 @@ def actual_or_dry_run_print(actually_rename7):
         print("This is a dry run of renaming...")
 
 
-def print_proposed_changes(proposed_changes, verbose7=False):
+def print_proposed_changes(proposed_changes):
     """
+    Only called in the verbose mode, so the caller skips it otherwise.
 
     >>> mock_proposed_changes = {"/old/path.txt": "/new/path.txt", "/old/path2.txt": "/new/path2.txt"}
-    >>> print_proposed_changes(mock_proposed_changes, verbose7=True)
+    >>> print_proposed_changes(mock_proposed_changes)
     Proposed:
     path.txt
     path.txt
@@ -50,12 +51,16 @@ def print_proposed_changes(proposed_changes, verbose7=False):
     path2.txt
     --------------------------------
     """
-    if verbose7:
-        for old_path, new_path in proposed_changes.items():
-            print("Proposed:")
-            print(f"{os.path.basename(old_path)}")
-            print(f"{os.path.basename(new_path)}")
-            print("--------------------------------")
+    basename = os.path.basename
+    for old_path, new_path in proposed_changes.items():
+        # a single print per change, instead of a print per line
+        print(
+            "Proposed:",
+            basename(old_path),
+            basename(new_path),
+            "--------------------------------",
+            sep="\n",
+        )
 
 
 def length_warning(max_full_name_len):
@@ -108,6 +113,29 @@ def length_warning(max_full_name_len):
         print("The max_full_name_len you selected is passing the sanity check")
 
 
+# built once, at import. --in-place and --where-to-copy exclude each other,
+# so argparse itself rejects using both
+PARSER = argparse.ArgumentParser(description="Rename directory with files.")
+PARSER.add_argument(
+    "--path", type=valid_path, required=True, help="Path to the directory"
+)
+PARSER.add_argument("--rename", action="store_true", help="Actually rename")
+WHERE_TO_RENAME_GROUP = PARSER.add_mutually_exclusive_group()
+WHERE_TO_RENAME_GROUP.add_argument(
+    "--in-place", action="store_true", help="Rename in-place"
+)
+WHERE_TO_RENAME_GROUP.add_argument(
+    "--where-to-copy", type=valid_path, help="Expects a path"
+)
+PARSER.add_argument("--symlinks", action="store_true", help="Replace symlinks")
+PARSER.add_argument(
+    "--max-name-len", type=int, required=True, help="Max full name length"
+)
+PARSER.add_argument(
+    "--max-path-len", type=int, required=True, help="Max path length"
+)
+
+
 def parse_terminal_args():
     """
     TODO: move it from here
@@ -161,26 +189,10 @@ def parse_terminal_args():
     InvalidPathError raised: Parent directory of '/invalid/path' does not exist
     """
 
-    parser = argparse.ArgumentParser(description="Rename directory with files.")
-    parser.add_argument(
-        "--path", type=valid_path, required=True, help="Path to the directory"
-    )
-    parser.add_argument("--rename", action="store_true", help="Actually rename")
-    parser.add_argument("--in-place", action="store_true", help="Rename in-place")
-    parser.add_argument("--where-to-copy", type=valid_path, help="Expects a path")
-    parser.add_argument("--symlinks", action="store_true", help="Replace symlinks")
-    parser.add_argument(
-        "--max-name-len", type=int, required=True, help="Max full name length"
-    )
-    parser.add_argument(
-        "--max-path-len", type=int, required=True, help="Max path length"
-    )
-    args = parser.parse_args()
-
-    if args.in_place and args.where_to_copy:
-        parser.error("Cannot use both --in-place and --where-to-copy")
-    elif args.rename and not (args.in_place or args.where_to_copy):
-        parser.error(
+    args = PARSER.parse_args()
+
+    if args.rename and not (args.in_place or args.where_to_copy):
+        PARSER.error(
             "Must specify either --in-place or --where-to-copy when using --rename"
         )
     return args
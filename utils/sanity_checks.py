@@ -1,6 +1,71 @@
 import os
 
 
+def is_positive_int(value):
+    """
+    A bool is an int too, but not a length.
+
+    >>> is_positive_int(255), is_positive_int(0), is_positive_int("255"), is_positive_int(True)
+    (True, False, False, False)
+    """
+    return type(value) is int and value > 0
+
+
+def is_bool(value):
+    """
+    >>> is_bool(False), is_bool(0)
+    (True, False)
+    """
+    return type(value) is bool
+
+
+def is_optional_path(value):
+    """
+    >>> is_optional_path(None), is_optional_path("some/dir"), is_optional_path(3)
+    (True, True, False)
+    """
+    return value is None or isinstance(value, (str, os.PathLike))
+
+
+def check_where_to_copy(where_to_copy, directory_path):
+    """
+    The copy must go to another dir, and not inside the dir being copied.
+
+    >>> check_where_to_copy(None, "some/dir"), check_where_to_copy("some/dir/copy", "some/dir")
+    (True, False)
+    >>> check_where_to_copy("some/dir_copy", "some/dir"), check_where_to_copy("/some/dir", "/")
+    (True, False)
+
+    >>> # on Windows, the same dir in a different case is still the same dir
+    >>> import ntpath
+    >>> from unittest.mock import patch
+    >>> with patch("os.path", ntpath):
+    ...     check_where_to_copy(r"C:\\Data\\Photos", r"c:\\data\\photos"), check_where_to_copy(r"C:\\Data\\Photos\\copy", r"c:\\data\\photos")
+    (False, False)
+    """
+    if where_to_copy is None:
+        return True
+    # normcase, as the paths are case-insensitive on Windows (like in commonpath)
+    directory_path = os.path.normcase(os.path.abspath(directory_path))
+    where_to_copy = os.path.normcase(os.path.abspath(where_to_copy))
+    different_dirs7 = where_to_copy != directory_path
+    # inside if it starts with the dir and a separator
+    inside_source7 = where_to_copy.startswith(os.path.join(directory_path, ""))
+    return different_dirs7 and not inside_source7
+
+
+# the checks of each input on its own. where_to_copy is also checked against directory_path
+FIRST_ORDER_QUALITY_CRITERIA = {
+    "directory_path": os.path.exists,
+    "where_to_copy": is_optional_path,
+    "max_full_name_len": is_positive_int,
+    "max_path_len": is_positive_int,
+    "actually_rename7": is_bool,
+    "in_place7": is_bool,
+    "replace_symlinks7": is_bool,
+}
+
+
 def sanity_check_user_inputs(**args_dict):
     """
     Perform sanity checks on user inputs for the rename_dir_with_files function.
@@ -103,28 +168,11 @@ def sanity_check_user_inputs(**args_dict):
     ...     os.rmdir(temp_dir)
     The value for where_to_copy is invalid
     """
-    def check_where_to_copy(where_to_copy):
-        if where_to_copy is None:
-            return True
-        directory_path = os.path.abspath(args_dict["directory_path"])
-        where_to_copy = os.path.abspath(where_to_copy)
-        different_dirs7 = where_to_copy != directory_path
-        inside_source7 = os.path.commonpath([directory_path, where_to_copy]) == directory_path
-        return different_dirs7 and not inside_source7
-
-    first_order_quality_criteria = {
-        "directory_path": os.path.exists,
-        "where_to_copy": check_where_to_copy,
-        "max_full_name_len": lambda x: isinstance(x, int) and x > 0,
-        "max_path_len": lambda x: isinstance(x, int) and x > 0,
-        "actually_rename7": lambda x: isinstance(x, bool),
-        "in_place7": lambda x: isinstance(x, bool),
-        "replace_symlinks7": lambda x: isinstance(x, bool),
-    }
-
     for key, value in args_dict.items():
-        if key in first_order_quality_criteria:
-            if not first_order_quality_criteria[key](value):
-                raise ValueError(f"The value for {key} is invalid")
-        else:
-            raise ValueError(f"Implement a sanity check for: {key}")
\ No newline at end of file
+        if key not in FIRST_ORDER_QUALITY_CRITERIA:
+            raise ValueError(f"Implement a sanity check for: {key}")
+        valid7 = FIRST_ORDER_QUALITY_CRITERIA[key](value)
+        if valid7 and key == "where_to_copy":
+            valid7 = check_where_to_copy(value, args_dict["directory_path"])
+        if not valid7:
+            raise ValueError(f"The value for {key} is invalid")